@@ -1,12 +1,11 @@
-import requests
 import os
-import cfgrib
+import sys
 import matplotlib.pyplot as plt
-from mpl_toolkits.basemap import Basemap
 import numpy as np
-from scipy.ndimage import gaussian_filter, minimum_filter, maximum_filter
-from PIL import Image
-from datetime import datetime
+from scipy.ndimage import gaussian_filter
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from gfs import animation, basemaps, catalog, download, ingest, pressure, render, tracks
 
 def clear_folder(folder_path):
     """Deletes all files in the specified folder."""
@@ -16,84 +15,75 @@ def clear_folder(folder_path):
             if os.path.isfile(file_path):
                 os.remove(file_path)
 
-def download_grib_files():
-    today = datetime.now()
-    date_str = today.strftime("%Y%m%d")
-    current_hour = today.hour
-    run_hour = (current_hour // 6) * 6
-    hour_str = f"{run_hour:02d}"
-    forecast_steps = [f"f{str(i).zfill(3)}" for i in range(13)] + [f"f{str(i).zfill(3)}" for i in range(12, 97, 6)]
-    
-    output_folders = [
-        os.path.join(os.getcwd(), 'public', 'mslet'),
-        os.path.join(os.getcwd(), 'public', 'grib', 'surft')  # Added folder
-    ]
-    
-    for folder in output_folders:
-        os.makedirs(folder, exist_ok=True)
-        clear_folder(folder)
-    
-    for step in forecast_steps:
-        url = f"https://nomads.ncep.noaa.gov/cgi-bin/filter_gfs_1p00.pl?dir=%2Fgfs.{date_str}%2F{hour_str}%2Fatmos&file=gfs.t{hour_str}z.pgrb2.1p00.{step}&var_MSLET=on&var_PRMSL=on&lev_mean_sea_level=on"
-        output_filename = os.path.join(output_folders[0], f"gfs_t{hour_str}z_pgrb2_1p00_{step}.grb2")
-        response = requests.get(url)
-        if response.status_code == 200:
-            with open(output_filename, 'wb') as file:
-                file.write(response.content)
+# Cached geography every frame is drawn on: map, lines, width in inches and dpi of the saved frames
+base_layer = ("north_america", basemaps.COUNTY_LINES, 12, 300)
 
-def create_png_from_grib(file_path, output_folder):
-    forecast_hour = file_path.split("_")[-1].replace(".grb2", "").replace("f", "")
-    ds = cfgrib.open_dataset(file_path, filter_by_keys={'typeOfLevel': 'meanSea'})
-    lons, lats = np.meshgrid(ds.longitude.values, ds.latitude.values)
-    mslp = ds.prmsl.values / 100
+# Formats the animation is written in (gfs.animation.FORMATS), the GIF stays for older browsers
+animation_formats = ("gif", "webp", "mp4")
+
+def create_png_from_grib(run_id, output_folder, hour_str, step):
+    forecast_hour = step.replace("f", "")
+    prmsl = ingest.load_field(run_id, step, download.PRMSL, "mslp")
+    if prmsl is None:
+        print(f"No pressure was decoded for {step}.")
+        return []
+    mslp = prmsl.values / 100
     min_val, max_val = np.nanmin(mslp), np.nanmax(mslp)
     if np.isnan(min_val) or np.isnan(max_val) or min_val >= max_val:
         raise ValueError("Invalid data detected.")
     
     mslp_smoothed = gaussian_filter(mslp, sigma=2)
-    lows = (mslp_smoothed == minimum_filter(mslp_smoothed, 10))
-    highs = (mslp_smoothed == maximum_filter(mslp_smoothed, 10))
-    
     plt.figure(figsize=(16, 10), dpi=120)
-    m = Basemap(projection='lcc', resolution='i', lat_0=37.5, lon_0=-98.35, width=9e6, height=6e6)
-    m.drawcoastlines(linewidth=0.8)
-    m.drawcountries(linewidth=0.8)
-    m.drawstates(linewidth=0.5)
-    m.drawcounties(linewidth=0.4, color='gray')
-    x, y = m(lons, lats)
-    x_mask = (x >= 0) & (x <= m.urcrnrx) & (y >= 0) & (y <= m.urcrnry)
+    m = basemaps.get_basemap("north_america")
+    basemaps.draw_base_layer(m, *base_layer, zorder=1.5)  # Under the isobars, as when they were drawn first
+    # Map coordinates of the grid and the points inside the map, projected once and shared by every frame
+    x, y, x_mask = basemaps.project_grid(m, "north_america", prmsl.lats, prmsl.lons)
     mslp = np.where(x_mask, mslp, np.nan)
-    contour_levels = np.arange(min_val, max_val, 4) if min_val < max_val else np.linspace(980, 1040, 20)
+    # Isobars every 4 hPa on multiples of 4, so they do not move with the box the field is cut to
+    contour_levels = np.arange(4 * np.floor(min_val / 4), max_val, 4) if min_val < max_val else np.linspace(980, 1040, 20)
     contour_lows = m.contour(x, y, mslp, levels=contour_levels[contour_levels < 1019], colors="red", linewidths=1.2)
     contour_highs = m.contour(x, y, mslp, levels=contour_levels[contour_levels >= 1019], colors="blue", linewidths=1.2)
     plt.clabel(contour_lows, inline=True, fontsize=9, fmt="%1.0f", colors='red')
     plt.clabel(contour_highs, inline=True, fontsize=9, fmt="%1.0f", colors='blue')
-    for i in range(mslp.shape[0]):
-        for j in range(mslp.shape[1]):
-            if x_mask[i, j]:
-                if highs[i, j]:
-                    plt.text(x[i, j], y[i, j], 'H', color='blue', fontsize=16, fontweight='bold', ha='center', va='center')
-                elif lows[i, j]:
-                    plt.text(x[i, j], y[i, j], 'L', color='red', fontsize=16, fontweight='bold', ha='center', va='center')
+    # One label per high and low center inside the map, found in a single NumPy pass
+    centers = pressure.find_centers(mslp_smoothed, values=mslp, mask=x_mask, size=10)
+    pressure.draw_centers(plt.gca(), x, y, centers, show_values=False, fontsize=16)
     plt.title(f"High and Low Pressure Systems Over the USA (Forecast Hour: {forecast_hour})", fontsize=14, fontweight='bold')
     plt.grid(True, linestyle='--', linewidth=0.5)
-    output_filename = os.path.join(output_folder, f"{os.path.basename(file_path)}.png")
+    output_filename = frame_path(output_folder, hour_str, step)
     plt.savefig(output_filename, bbox_inches='tight', dpi=300)
     plt.close()
+    # The centers of this step, for linking into tracks
+    return tracks.locate(centers, prmsl.lats, prmsl.lons)
+
+# Function to get the path of the frame of one step
+def frame_path(output_folder, hour_str, step):
+    return os.path.join(output_folder, f"gfs_t{hour_str}z_pgrb2_1p00_{step}.grb2.png")
 
-def create_gif_from_png(output_folder):
-    png_files = sorted([f for f in os.listdir(output_folder) if f.endswith(".png")])
-    images = [Image.open(os.path.join(output_folder, f)) for f in png_files]
-    if images:
-        gif_filename = os.path.join(os.getcwd(), 'public', 'HL', 'animation.gif')
-        images[0].save(gif_filename, save_all=True, append_images=images[1:], duration=500, loop=0)
+if __name__ == '__main__':
+    output_folder = os.path.join(os.getcwd(), 'public', 'HL')
+    os.makedirs(output_folder, exist_ok=True)
+    clear_folder(output_folder)
+    # Fetch the latest run once for every product (steps already on disk are skipped)
+    run = ingest.ingest()
+    if run is not None:
+        date_str, hour_str = run
+        # Draw the geography once here so the render workers share it
+        basemaps.base_layer(*base_layer)
+        # Draw the frames in parallel, each one in its own process, and add each one to the animations
+        # as soon as it and the ones before it are done
+        # Only the steps the 1p00 grid is published at
+        steps = ingest.product_steps("mslp")
+        tasks = [(date_str + hour_str, output_folder, hour_str, step) for step in steps]
+        centers = []
+        with animation.Animations(os.path.join(output_folder, 'animation.gif'), animation_formats, duration=500) as animations:
+            for step, step_centers in zip(steps, render.iter_frames(create_png_from_grib, tasks)):
+                centers.append(step_centers)
+                if os.path.exists(frame_path(output_folder, hour_str, step)):
+                    animations.add(frame_path(output_folder, hour_str, step))
+        # Link the centers of the frames into tracks the web app overlays on the animation
+        center_tracks = tracks.link_centers(steps, centers)
+        tracks.export_json(center_tracks, os.path.join(output_folder, "tracks.json"), date_str + hour_str)
 
-output_folder = os.path.join(os.getcwd(), 'public', 'HL')
-os.makedirs(output_folder, exist_ok=True)
-clear_folder(output_folder)
-download_grib_files()
-grib_folder = os.path.join(os.getcwd(), 'public', 'mslet')
-for file_name in os.listdir(grib_folder):
-    if file_name.endswith(".grb2"):
-        create_png_from_grib(os.path.join(grib_folder, file_name), output_folder)
-create_gif_from_png(output_folder)
+    # Publish the new files to the web app's catalog
+    catalog.publish("HL", output_folder, None if run is None else "".join(run))
@@ -1,6 +1,11 @@
-from flask import Flask, send_from_directory, render_template_string, request
+from flask import Flask, Response, send_from_directory, redirect, render_template, request, url_for
+import hashlib
+import json
+import mimetypes
 import os
 
+from gfs import catalog, point, tiles, variants
+
 app = Flask(__name__)
 
 # Paths to the folders containing images and GIFs
@@ -9,122 +14,297 @@ HL_FOLDER = os.path.join('public', 'HL')
 NORTHEAST_FOLDER = os.path.join('public', 'RS', 'Northeast')
 USA_FOLDER = os.path.join('public', 'RS', 'USA')
 
+# Gallery folders by the name the page selects them with
+FOLDERS = {'temp': TEMP_FOLDER, 'HL': HL_FOLDER, 'Northeast': NORTHEAST_FOLDER, 'USA': USA_FOLDER}
+
+# Files listed in the gallery, kept in memory and refreshed when the product scripts publish a new run
+IMAGE_EXTENSIONS = catalog.IMAGE_EXTENSIONS
+VIDEO_EXTENSIONS = catalog.VIDEO_EXTENSIONS
+gallery = catalog.Catalog(FOLDERS)
+
+# Fingerprinted image URLs always point at the same content, so browsers and proxies may keep them for a year
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+# Page of the gallery, compiled once when the app starts
+GALLERY_HTML = """
+<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Image Gallery</title>
+    <style>
+        body {
+            font-family: Arial, sans-serif;
+            text-align: center;
+            margin: 0;
+            height: 100%;
+            display: flex;
+            justify-content: center;
+            align-items: center;
+            flex-direction: column;
+            background-color: #f0f0f0;
+        }
+        select {
+            padding: 10px;
+            font-size: 18px;
+            margin-bottom: 20px;
+        }
+        img, video {
+            max-width: 100%;
+            max-height: 90vh;
+            object-fit: contain;
+            border-radius: 10px;
+        }
+        h1 {
+            margin-bottom: 20px;
+            font-size: 2em;
+        }
+    </style>
+    <script>
+        function updateImage() {
+            var selectedFile = document.getElementById("imageSelector").value;
+            var selectedFolder = document.getElementById("folderSelector").value;
+            window.location.href = "/?folder=" + selectedFolder + "&selected=" + selectedFile;
+        }
+    </script>
+</head>
+<body>
+    <h1>Image & GIF Viewer</h1>
+
+    <!-- Folder Selector -->
+    <label for="folderSelector">Select folder:</label>
+    <select id="folderSelector" onchange="updateImage()">
+        <option value="temp" {% if selected_folder == 'temp' %}selected{% endif %}>Temp Folder</option>
+        <option value="HL" {% if selected_folder == 'HL' %}selected{% endif %}>HL Folder</option>
+        <option value="Northeast" {% if selected_folder == 'Northeast' %}selected{% endif %}>Northeast Folder</option>
+        <option value="USA" {% if selected_folder == 'USA' %}selected{% endif %}>USA Folder</option>
+    </select>
+    <br><br>
+
+    <!-- Image Selector -->
+    <label for="imageSelector">Select an image:</label>
+    <select id="imageSelector" onchange="updateImage()">
+        {% for file in files %}
+            <option value="{{ file }}" {% if file == selected_file %}selected{% endif %}>{{ file }}</option>
+        {% endfor %}
+    </select>
+
+    <br><br>
+    {% if selected_file and selected_file.lower().endswith(video_extensions) %}
+        <video src="{{ image_url(selected_folder, selected_file) }}" autoplay loop muted playsinline controls></video>
+    {% elif selected_file %}
+        <picture>
+            {% if webp_file %}
+                <source srcset="{{ image_url(selected_folder, webp_file) }}" type="image/webp">
+            {% endif %}
+            {% set srcset = image_srcset(selected_folder, selected_file) %}
+            <img src="{{ image_url(selected_folder, selected_file) }}" {% if srcset %}srcset="{{ srcset }}" sizes="100vw"{% endif %} alt="{{ selected_file }}">
+        </picture>
+    {% else %}
+        <p>No images found in the selected folder.</p>
+    {% endif %}
+</body>
+</html>
+"""
+GALLERY_TEMPLATE = app.jinja_env.from_string(GALLERY_HTML)
+
 @app.route('/', methods=['GET'])
 def index():
-    # Get list of image and GIF files from all folders
-    temp_files = [f for f in os.listdir(TEMP_FOLDER) if f.lower().endswith(('.png', '.jpg', '.jpeg', '.gif'))]
-    hl_files = [f for f in os.listdir(HL_FOLDER) if f.lower().endswith(('.png', '.jpg', '.jpeg', '.gif'))]
-    northeast_files = [f for f in os.listdir(NORTHEAST_FOLDER) if f.lower().endswith(('.png', '.jpg', '.jpeg', '.gif'))]
-    usa_files = [f for f in os.listdir(USA_FOLDER) if f.lower().endswith(('.png', '.jpg', '.jpeg', '.gif'))]
-
-    # Get selected folder and file from the dropdown (default to first file in 'temp' folder)
+    # Get the selected folder and its files from the catalog (default to the first file in the 'temp' folder)
     selected_folder = request.args.get('folder', 'temp')
-    selected_file = request.args.get('selected', temp_files[0] if selected_folder == 'temp' else
-                                    hl_files[0] if selected_folder == 'HL' else
-                                    northeast_files[0] if selected_folder == 'Northeast' else
-                                    usa_files[0] if selected_folder == 'USA' else '')
-
-    # Choose the appropriate folder and file list based on selection
-    if selected_folder == 'temp':
-        files = temp_files
-        folder_path = TEMP_FOLDER
-    elif selected_folder == 'HL':
-        files = hl_files
-        folder_path = HL_FOLDER
-    elif selected_folder == 'Northeast':
-        files = northeast_files
-        folder_path = NORTHEAST_FOLDER
-    else:
-        files = usa_files
-        folder_path = USA_FOLDER
-
-    html_content = """
-    <!DOCTYPE html>
-    <html lang="en">
-    <head>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <title>Image Gallery</title>
-        <style>
-            body {
-                font-family: Arial, sans-serif;
-                text-align: center;
-                margin: 0;
-                height: 100%;
-                display: flex;
-                justify-content: center;
-                align-items: center;
-                flex-direction: column;
-                background-color: #f0f0f0;
-            }
-            select {
-                padding: 10px;
-                font-size: 18px;
-                margin-bottom: 20px;
-            }
-            img {
-                max-width: 100%;
-                max-height: 90vh;
-                object-fit: contain;
-                border-radius: 10px;
-            }
-            h1 {
-                margin-bottom: 20px;
-                font-size: 2em;
-            }
-        </style>
-        <script>
-            function updateImage() {
-                var selectedFile = document.getElementById("imageSelector").value;
-                var selectedFolder = document.getElementById("folderSelector").value;
-                window.location.href = "/?folder=" + selectedFolder + "&selected=" + selectedFile;
-            }
-        </script>
-    </head>
-    <body>
-        <h1>Image & GIF Viewer</h1>
-
-        <!-- Folder Selector -->
-        <label for="folderSelector">Select folder:</label>
-        <select id="folderSelector" onchange="updateImage()">
-            <option value="temp" {% if selected_folder == 'temp' %}selected{% endif %}>Temp Folder</option>
-            <option value="HL" {% if selected_folder == 'HL' %}selected{% endif %}>HL Folder</option>
-            <option value="Northeast" {% if selected_folder == 'Northeast' %}selected{% endif %}>Northeast Folder</option>
-            <option value="USA" {% if selected_folder == 'USA' %}selected{% endif %}>USA Folder</option>
-        </select>
-        <br><br>
-
-        <!-- Image Selector -->
-        <label for="imageSelector">Select an image:</label>
-        <select id="imageSelector" onchange="updateImage()">
-            {% for file in files %}
-                <option value="{{ file }}" {% if file == selected_file %}selected{% endif %}>{{ file }}</option>
-            {% endfor %}
-        </select>
-
-        <br><br>
-        {% if selected_file %}
-            <img src="{{ url_for('get_image', folder=selected_folder, filename=selected_file) }}" alt="{{ selected_file }}">
-        {% else %}
-            <p>No images found in the selected folder.</p>
-        {% endif %}
-    </body>
-    </html>
-    """
-    return render_template_string(html_content, files=files, selected_file=selected_file, selected_folder=selected_folder)
+    if selected_folder not in FOLDERS:
+        selected_folder = 'USA'
+    files = gallery.files(selected_folder)
+    selected_file = request.args.get('selected', files[0] if files else '')
+
+    # Browsers that support WebP get the WebP version of a GIF animation, which is much smaller
+    webp_file = os.path.splitext(selected_file)[0] + '.webp' if selected_file.lower().endswith('.gif') else None
+    if webp_file not in files:
+        webp_file = None
+
+    return render_template(GALLERY_TEMPLATE, files=files, selected_file=selected_file, selected_folder=selected_folder,
+                           webp_file=webp_file, video_extensions=VIDEO_EXTENSIONS)
+
+@app.template_global()
+def image_url(folder, filename):
+    # URL of a gallery file carrying its fingerprint, so it changes with every run and can be cached for good
+    file = gallery.file(folder, filename)
+    if file is None:
+        return url_for('get_image', folder=folder, filename=filename)
+    return url_for('get_fingerprinted_image', folder=folder, fingerprint=catalog.fingerprint(file), filename=filename)
+
+@app.template_global()
+def image_srcset(folder, filename):
+    # srcset of a frame with variants: its URL at each width they come in, the browser picks what its screen needs
+    file = gallery.file(folder, filename)
+    if file is None or not file.get('variants'):
+        return ''
+    url = image_url(folder, filename)
+    widths = sorted({variant['width'] for variant in file['variants']})
+    return ', '.join(f"{url}?w={width} {width}w" if width < file['width'] else f"{url} {width}w" for width in widths)
+
+# Function to get the image types a variant may be sent in: the compact ones the browser lists by name
+# (a */* does not count, browsers without WebP send it too), then the frame's own
+def accepted_types(filename):
+    accepted = [mimetype for mimetype in variants.ENCODINGS
+                if any(value == mimetype and quality > 0 for value, quality in request.accept_mimetypes)]
+    return accepted + [variants.MIMETYPES.get(os.path.splitext(filename)[1].lower())]
+
+# Function to send a gallery file, with its catalog checksum as ETag when the file on disk is still the one
+# the catalog lists. Frames with variants are sent in the one that fits the width asked for (w) and the
+# Accept header. Range and If-None-Match requests are answered by send_from_directory.
+# Returns the response and whether the file matched the catalog.
+def send_gallery_file(folder, filename, max_age=None):
+    file = gallery.file(folder, filename)
+    current = False
+    if file is not None:
+        try:
+            stat = os.stat(os.path.join(FOLDERS[folder], filename))
+            current = stat.st_size == file['size'] and stat.st_mtime == file['modified']
+        except OSError:
+            pass
+    if current and file.get('variants'):
+        variant = variants.pick(file, accepted_types(filename), request.args.get('w', type=int))
+        if variant is not None:
+            response = send_from_directory(FOLDERS[folder], variant['name'], mimetype=variant['type'],
+                                           etag=variant['sha256'], max_age=max_age)
+        else:
+            response = send_from_directory(FOLDERS[folder], filename, etag=file['sha256'], max_age=max_age)
+        response.vary.add('Accept')
+        return response, current
+    etag = file['sha256'] if current and 'sha256' in file else True
+    response = send_from_directory(FOLDERS[folder], filename, etag=etag, max_age=max_age if current else None)
+    return response, current
 
 @app.route('/images/<folder>/<filename>')
 def get_image(folder, filename):
-    # Serve image from the selected folder
-    if folder == 'temp':
-        return send_from_directory(TEMP_FOLDER, filename)
-    elif folder == 'HL':
-        return send_from_directory(HL_FOLDER, filename)
-    elif folder == 'Northeast':
-        return send_from_directory(NORTHEAST_FOLDER, filename)
-    elif folder == 'USA':
-        return send_from_directory(USA_FOLDER, filename)
+    # Serve image from the selected folder. The name stays the same from run to run, so browsers
+    # check back with the ETag every time and get a 304 while the file has not changed.
+    if folder in FOLDERS:
+        response, _ = send_gallery_file(folder, filename)
+        response.cache_control.no_cache = True
+        return response
     return "Folder not found", 404
 
+@app.route('/images/<folder>/<fingerprint>/<filename>')
+def get_fingerprinted_image(folder, fingerprint, filename):
+    # Serve an image by its fingerprinted URL with a long-lived immutable Cache-Control
+    file = gallery.file(folder, filename)
+    if file is None:
+        return "Image not found", 404
+    if catalog.fingerprint(file) != fingerprint:
+        # A URL of an older run, send the browser to the current one
+        return redirect(image_url(folder, filename))
+    response, current = send_gallery_file(folder, filename, max_age=IMMUTABLE_MAX_AGE)
+    if current:
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+    else:
+        # The file is being rewritten by a new run that is not published yet: do not let it be kept
+        response.cache_control.no_cache = True
+    return response
+
+# Function to send JSON that clients poll, with an ETag of its content so an unchanged answer is a bodiless 304
+def poll_response(data):
+    body = json.dumps(data, sort_keys=True).encode()
+    response = Response(body, mimetype='application/json')
+    response.set_etag(hashlib.sha256(body).hexdigest()[:32])
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+# Function to describe the current run of a gallery folder: its frames by forecast step with their valid
+# time, URL, size, render time and variants, and its animations
+def run_summary(name, product):
+    run = product['run']
+    frames = []
+    animations = []
+    for file in product['files']:
+        entry = {
+            'name': file['name'],
+            'url': image_url(name, file['name']),
+            'type': mimetypes.guess_type(file['name'])[0],
+            'size': file['size'],
+            'rendered': catalog.iso_time(file['modified']),
+        }
+        if file['hour'] is None:
+            animations.append(entry)
+            continue
+        entry['step'] = f"f{file['hour']:03d}"
+        entry['hour'] = file['hour']
+        entry['valid'] = catalog.iso_time(catalog.valid_time(run, file['hour']))
+        if file.get('variants'):
+            entry['width'] = file['width']
+            entry['variants'] = [{'url': entry['url'] if variant['width'] == file['width'] else f"{entry['url']}?w={variant['width']}",
+                                  'width': variant['width'], 'type': variant['type'], 'size': variant['size']}
+                                 for variant in file['variants']]
+        frames.append(entry)
+    return {
+        'product': name,
+        'run': run,
+        'date': run[:8] if run else None,
+        'hour': run[8:] if run else None,
+        'initialized': catalog.iso_time(catalog.run_time(run)),
+        'published': catalog.iso_time(product['published']),
+        'steps': sorted({frame['step'] for frame in frames}),
+        'frames': frames,
+        'animations': animations,
+    }
+
+@app.route('/api/products')
+def api_products():
+    # Products of the gallery with their current run and where to find it
+    products = []
+    for name in FOLDERS:
+        product = gallery.product(name)
+        run = product['run'] or 'latest'
+        products.append({
+            'product': name,
+            'run': product['run'],
+            'published': catalog.iso_time(product['published']),
+            'files': len(product['files']),
+            'url': url_for('api_product_run', product=name, run=run),
+        })
+    return poll_response({'products': products})
+
+@app.route('/api/products/<product>/runs/<run>')
+def api_product_run(product, run):
+    # One run of a product, 'latest' for the current one. Only the current run is kept on disk.
+    summary = gallery.product(product)
+    if summary is None:
+        return {'error': f"Unknown product {product}"}, 404
+    if run != 'latest' and run != summary['run']:
+        return {'error': f"Run {run} of {product} is not available", 'run': summary['run']}, 404
+    return poll_response(run_summary(product, summary))
+
+@app.route('/api/point')
+def api_point():
+    # Forecast of every step of the latest run at one place, e.g. /api/point?lat=42.65&lon=-73.75,
+    # read from the decoded fields (method=bilinear to interpolate between grid cells).
+    # "precip" is one of "none" (dry), "rain", "snow", "sleet" or "freezing_rain", and null like the
+    # other values where the step was not decoded.
+    lat = request.args.get('lat', type=float)
+    lon = request.args.get('lon', type=float)
+    method = request.args.get('method', 'nearest')
+    if lat is None or lon is None or not -90 <= lat <= 90:
+        return {'error': "lat (-90 to 90) and lon are required"}, 400
+    if method not in point.METHODS:
+        return {'error': f"method must be one of {', '.join(point.METHODS)}"}, 400
+    series = point.forecast(lat, lon, method)
+    if series is None:
+        return {'error': "No decoded run available"}, 404
+    return poll_response(series)
+
+@app.route('/tiles/<product>/<step>/<int:z>/<int:x>/<int:y>.png')
+def get_tile(product, step, z, x, y):
+    # Serve one XYZ map tile of a product, written by the product scripts into gfs.tiles stores.
+    # Unknown products and steps that are not (or no longer) written have no store at all.
+    path = tiles.tile_path(product, step)
+    if path is None or not os.path.exists(path):
+        return "Tile not found", 404
+    tile = tiles.read_tile(product, step, z, x, y)
+    # Parts of the map without data get a transparent tile, so map clients show nothing there
+    return Response(tiles.EMPTY_TILE if tile is None else tile, mimetype='image/png')
+
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1 @@
+# Shared helpers for the GFS product scripts (downloading, caching and rendering)
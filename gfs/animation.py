@@ -0,0 +1,266 @@
+import os
+import shutil
+import subprocess
+
+import numpy as np
+from PIL import GifImagePlugin, Image
+
+# Animations of the product frames, written as the frames are rendered. Each product picks its formats
+# by file extension: GIF is written one frame at a time, WebP and APNG through Pillow (whose encoders
+# take all frames at once, so these keep each frame palette-indexed, one byte per pixel, until the end)
+# and MP4/WebM by piping the frames into a local ffmpeg, when one is installed.
+FORMATS = ("gif", "webp", "apng", "mp4", "webm")
+
+# ffmpeg binary used for the video formats, GFS_FFMPEG overrides the one found on the PATH
+FFMPEG = os.environ.get("GFS_FFMPEG") or shutil.which("ffmpeg")
+
+# Pillow options of the formats it encodes. Lossless WebP suits the flat colors and sharp lines of the
+# maps better than lossy (about a third smaller than the GIF, where lossy came out larger than it).
+PILLOW_OPTIONS = {
+    "webp": {"format": "WEBP", "lossless": True, "quality": 80, "method": 4},
+    "apng": {"format": "PNG", "optimize": False},
+}
+
+# ffmpeg output options of the video formats
+VIDEO_OPTIONS = {
+    "mp4": ["-c:v", "libx264", "-preset", "medium", "-crf", "23", "-pix_fmt", "yuv420p",
+            "-movflags", "+faststart", "-f", "mp4"],
+    "webm": ["-c:v", "libvpx-vp9", "-b:v", "0", "-crf", "33", "-pix_fmt", "yuv420p", "-f", "webm"],
+}
+
+
+# Function to get a palette image of at most 255 colors for frames that do not bring their own.
+# colors (RGB or RGBA rows) get entries of their own next to the image's, for colors that later
+# frames show and this one may not.
+def frame_palette(image, colors=()):
+    colors = list(dict.fromkeys(tuple(int(channel) for channel in color[:3]) for color in colors))
+    if not colors and image.mode == "P" and len(image.getpalette()) // 3 <= 255:
+        return image.copy()
+    quantized = image.convert("RGB").quantize(255 - len(colors), method=Image.Quantize.FASTOCTREE,
+                                              dither=Image.Dither.NONE)
+    if not colors:
+        return quantized
+    entries = quantized.getpalette()[:3 * (255 - len(colors))]
+    entries = [tuple(entries[i:i + 3]) for i in range(0, len(entries), 3)]
+    palette = Image.new("P", (1, 1))
+    palette.putpalette([channel for color in entries + [c for c in colors if c not in entries] for channel in color])
+    return palette
+
+
+class FrameWriter:
+    # Base of the animation writers: a file written under a temporary name and moved into place once
+    # complete, frames of the size of the first one and (for the image formats) one shared palette.
+    # palette is a PIL palette image of at most 255 colors the frames are drawn in, such as the
+    # gfs.raster palette of the product. Without one, the palette of the first frame is used when it is
+    # already palette-indexed, else one taken from it that also holds colors (see frame_palette).
+    def __init__(self, path, duration=500, loop=0, palette=None, colors=()):
+        self.path = path
+        self.temp_path = f"{path}.tmp"
+        self.duration = duration
+        self.loop = loop
+        self.size = None
+        self.palette = palette
+        self.colors = colors
+        self.count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        if kind is None:
+            self.close()
+        else:
+            self.abort()
+
+    # Paste a frame on a white canvas of the size of the first frame if its size differs
+    def fit(self, frame):
+        if frame.size == self.size:
+            return frame
+        canvas = Image.new("RGB", self.size, "white")
+        canvas.paste(frame.convert("RGB"))
+        return canvas
+
+    # Map a frame to the shared palette, the first frame sets the size and the palette if none was given
+    def index(self, frame):
+        if self.size is None:
+            self.size = frame.size
+            if self.palette is None:
+                self.palette = frame_palette(frame, self.colors)
+                if self.palette.size == frame.size:
+                    return np.asarray(self.palette)
+        frame = self.fit(frame)
+        if frame.mode == "P" and frame.getpalette() == self.palette.getpalette():
+            return np.asarray(frame)
+        return np.asarray(frame.convert("RGB").quantize(palette=self.palette, dither=Image.Dither.NONE))
+
+    # Add a frame, given as a PIL image or the path of an image file
+    def add(self, frame):
+        if isinstance(frame, (str, os.PathLike)):
+            with Image.open(frame) as image:
+                return self.add(image)
+        self.write(frame)
+        self.count += 1
+
+    # Finish the file and move it into place, returns its path or None if there were no frames
+    def close(self):
+        if self.count == 0:
+            print(f"No frames to write to {self.path}")
+            self.abort()
+            return None
+        self.finish()
+        os.replace(self.temp_path, self.path)
+        return self.path
+
+    def abort(self):
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+
+class GifWriter(FrameWriter):
+    # Writes an animated GIF frame by frame, so only the current and the previous frame are in memory.
+    # After the first frame only the box that changed is written, with the pixels that did not change
+    # inside it left transparent, so the static geography is encoded once.
+    def __init__(self, path, duration=500, loop=0, palette=None, colors=()):
+        super().__init__(path, duration, loop, palette, colors)
+        self.file = None
+        self.previous = None
+
+    # Wrap palette indexes into an image carrying the palette plus the transparent entry
+    def image(self, pixels):
+        image = Image.fromarray(pixels, "P")
+        image.putpalette(self.colors)
+        return image
+
+    def write(self, frame):
+        pixels = self.index(frame)
+        if self.file is None:
+            # One more color after the palette's own is the transparent one
+            self.colors = self.palette.getpalette() + [0, 0, 0]
+            self.transparency = len(self.colors) // 3 - 1
+            header, _ = GifImagePlugin.getheader(self.image(pixels), info={"loop": self.loop, "optimize": False})
+            self.file = open(self.temp_path, 'wb')
+            self.file.write(b"".join(header))
+            box, offset = pixels, (0, 0)
+        else:
+            changed = pixels != self.previous
+            if not changed.any():
+                # Nothing moved: a single pixel keeps the frame and its duration
+                changed[0, 0] = True
+            rows = np.flatnonzero(changed.any(axis=1))
+            cols = np.flatnonzero(changed.any(axis=0))
+            area = (slice(rows[0], rows[-1] + 1), slice(cols[0], cols[-1] + 1))
+            box = np.where(changed[area], pixels[area], np.uint8(self.transparency))
+            offset = (int(cols[0]), int(rows[0]))
+
+        self.file.write(b"".join(GifImagePlugin.getdata(self.image(box), offset=offset, duration=self.duration,
+                                                        disposal=1, transparency=self.transparency)))
+        self.previous = pixels
+
+    def finish(self):
+        self.file.write(b";")
+        self.file.close()
+        self.file = None
+
+    def abort(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        super().abort()
+
+
+class PillowWriter(FrameWriter):
+    # Writes an animated WebP or APNG with Pillow, keeping the frames palette-indexed until the end
+    def __init__(self, path, duration=500, loop=0, kind="webp", palette=None, colors=()):
+        super().__init__(path, duration, loop, palette, colors)
+        self.options = PILLOW_OPTIONS[kind]
+        self.frames = []
+
+    def write(self, frame):
+        image = Image.fromarray(self.index(frame), "P")
+        image.putpalette(self.palette.getpalette())
+        self.frames.append(image)
+
+    def finish(self):
+        self.frames[0].save(self.temp_path, save_all=True, append_images=self.frames[1:], duration=self.duration,
+                            loop=self.loop, **self.options)
+        self.frames = []
+
+
+class VideoWriter(FrameWriter):
+    # Writes an MP4 or WebM video by piping each frame into ffmpeg as it comes
+    def __init__(self, path, duration=500, loop=0, kind="mp4"):
+        super().__init__(path, duration, loop)
+        self.options = VIDEO_OPTIONS[kind]
+        self.process = None
+
+    def write(self, frame):
+        if self.process is None:
+            # The encoders want even sizes
+            self.size = (frame.size[0] + frame.size[0] % 2, frame.size[1] + frame.size[1] % 2)
+            self.process = subprocess.Popen(
+                [FFMPEG, "-y", "-loglevel", "error", "-f", "rawvideo", "-pix_fmt", "rgb24",
+                 "-s", f"{self.size[0]}x{self.size[1]}", "-framerate", f"{1000 / self.duration:g}", "-i", "-",
+                 *self.options, self.temp_path], stdin=subprocess.PIPE)
+        self.process.stdin.write(self.fit(frame).convert("RGB").tobytes())
+
+    def finish(self):
+        self.process.stdin.close()
+        if self.process.wait() != 0:
+            raise RuntimeError(f"ffmpeg failed to write {self.path}")
+        self.process = None
+
+    def abort(self):
+        if self.process is not None:
+            self.process.stdin.close()
+            self.process.wait()
+            self.process = None
+        super().abort()
+
+
+# Function to open the writer of one animation file, picking the encoder from its extension.
+# palette and colors are those of the image formats (see FrameWriter), videos are written in full color.
+# Returns None for the video formats when ffmpeg is not installed.
+def open_writer(path, duration=500, loop=0, palette=None, colors=()):
+    kind = os.path.splitext(path)[1].lstrip(".").lower()
+    if kind == "gif":
+        return GifWriter(path, duration, loop, palette, colors)
+    if kind in PILLOW_OPTIONS:
+        return PillowWriter(path, duration, loop, kind, palette, colors)
+    if kind in VIDEO_OPTIONS:
+        if FFMPEG is None:
+            print(f"Skipping {path}: ffmpeg is not installed")
+            return None
+        return VideoWriter(path, duration, loop, kind)
+    raise ValueError(f"Unknown animation format {kind!r}, expected one of {FORMATS}")
+
+
+class Animations:
+    # The same animation written in several formats at once: path is the GIF path and the other
+    # formats are written next to it with their own extension. Each frame is read once for all of them.
+    # palette and colors make the shared palette of the image formats (see FrameWriter).
+    def __init__(self, path, formats=("gif",), duration=500, loop=0, palette=None, colors=()):
+        stem = os.path.splitext(path)[0]
+        writers = [open_writer(f"{stem}.{kind}", duration, loop, palette, colors) for kind in formats]
+        self.writers = [writer for writer in writers if writer is not None]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        if kind is None:
+            self.close()
+        else:
+            for writer in self.writers:
+                writer.abort()
+
+    def add(self, frame):
+        if isinstance(frame, (str, os.PathLike)):
+            with Image.open(frame) as image:
+                return self.add(image)
+        for writer in self.writers:
+            writer.add(frame)
+
+    # Close every writer, returns the paths of the files written
+    def close(self):
+        paths = [writer.close() for writer in self.writers]
+        return [path for path in paths if path is not None]
@@ -0,0 +1,147 @@
+import hashlib
+import os
+import pickle
+
+import numpy as np
+from PIL import Image
+
+from gfs.regions import MAPS
+
+# Basemaps and their static geography are the same for every frame, so they are built once:
+# each map's Basemap is pickled here, and its coast, country, state and county lines are drawn
+# once to a transparent PNG that every frame lays over its data.
+BASEMAP_FOLDER = os.environ.get("GFS_BASEMAP_FOLDER", os.path.join(".cache", "basemaps"))
+
+# Geography drawn by the products, as (Basemap method, keyword arguments)
+COUNTY_LINES = (
+    ("drawcoastlines", {"linewidth": 0.8}),
+    ("drawcountries", {"linewidth": 0.8}),
+    ("drawstates", {"linewidth": 0.5}),
+    ("drawcounties", {"linewidth": 0.4, "color": "gray"}),
+)
+STATE_LINES = (("drawcoastlines", {}), ("drawcountries", {}), ("drawstates", {}))
+
+# Basemaps, base layers and projected grids already loaded in this process
+_basemaps = {}
+_layers = {}
+_grids = {}
+
+
+# Function to get a short key for everything a cached file depends on
+def cache_key(*parts):
+    from mpl_toolkits import basemap
+
+    return hashlib.sha1(repr(parts + (basemap.__version__,)).encode()).hexdigest()[:12]
+
+
+# Function to write a file through a temporary name, so parallel workers never read half of it
+def write_atomic(path, write):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    write(temp_path)
+    os.replace(temp_path, path)
+
+
+# Function to get the Basemap of a map from gfs.regions.MAPS, drawing on ax (or the current axes)
+def get_basemap(name, resolution='i', ax=None):
+    if (name, resolution) not in _basemaps:
+        path = os.path.join(BASEMAP_FOLDER, f"{name}-{resolution}-{cache_key(MAPS[name], resolution)}.pickle")
+        try:
+            with open(path, 'rb') as file:
+                m = pickle.load(file)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            from mpl_toolkits.basemap import Basemap
+
+            m = Basemap(resolution=resolution, **MAPS[name])
+
+            def write(temp_path):
+                with open(temp_path, 'wb') as file:
+                    pickle.dump(m, file, protocol=pickle.HIGHEST_PROTOCOL)
+            write_atomic(path, write)
+        _basemaps[name, resolution] = m
+    m = _basemaps[name, resolution]
+    m.ax = ax
+    return m
+
+
+# Function to get the transparent RGBA image of a map's geography, drawn width inches wide at dpi
+# so the lines come out as thick as if they were drawn on the frame itself
+def base_layer(name, lines, width, dpi, resolution='i'):
+    path = os.path.join(BASEMAP_FOLDER, f"{name}-{cache_key(MAPS[name], lines, width, dpi, resolution)}.png")
+    if path not in _layers:
+        if not os.path.exists(path):
+            from matplotlib.backends.backend_agg import FigureCanvasAgg
+            from matplotlib.figure import Figure
+
+            m = get_basemap(name, resolution)
+            height = width * (m.urcrnry - m.llcrnry) / (m.urcrnrx - m.llcrnrx)
+            fig = Figure(figsize=(width, height), dpi=dpi)
+            FigureCanvasAgg(fig)
+            ax = fig.add_axes([0, 0, 1, 1])
+            ax.set_axis_off()
+            for method, kwargs in lines:
+                getattr(m, method)(ax=ax, **kwargs)
+            ax.set_xlim(m.llcrnrx, m.urcrnrx)
+            ax.set_ylim(m.llcrnry, m.urcrnry)
+            write_atomic(path, lambda temp_path: fig.savefig(temp_path, format="png", dpi=dpi, transparent=True))
+        with Image.open(path) as image:
+            _layers[path] = np.asarray(image.convert("RGBA"))
+    return _layers[path]
+
+
+# Function to lay a map's cached geography over what is drawn on its axes
+def draw_base_layer(m, name, lines, width, dpi, resolution='i', ax=None, zorder=3):
+    import matplotlib.pyplot as plt
+
+    ax = ax or m.ax or plt.gca()
+    ax.imshow(base_layer(name, lines, width, dpi, resolution), origin='upper', zorder=zorder,
+              extent=(m.llcrnrx, m.urcrnrx, m.llcrnry, m.urcrnry), interpolation='antialiased')
+    m.set_axes_limits(ax=ax)
+
+
+# Function to get a hash of the coordinates of a lat/lon grid
+def grid_hash(lats, lons):
+    return hashlib.sha1(np.ascontiguousarray(lats).tobytes() + np.ascontiguousarray(lons).tobytes()).hexdigest()
+
+
+# Function to save arrays as .npy files through write_atomic
+def save_arrays(paths, arrays):
+    for path, array in zip(paths, arrays):
+        def write(temp_path):
+            with open(temp_path, 'wb') as file:
+                np.save(file, array)
+        write_atomic(path, write)
+
+
+# Function to get the map coordinates x, y of every point of a lat/lon grid, and the mask of the
+# points inside the map. They are computed once per grid and map and kept as .npy files that are
+# memory-mapped, so every frame and every render worker reuses them.
+def project_grid(m, name, lats, lons):
+    key = cache_key(MAPS[name], grid_hash(lats, lons))
+    if key not in _grids:
+        paths = [os.path.join(BASEMAP_FOLDER, f"{name}-grid-{key}.{part}.npy") for part in ("x", "y", "mask")]
+        if not all(os.path.exists(path) for path in paths):
+            x, y = m(*np.meshgrid(lons, lats))
+            mask = (x >= m.llcrnrx) & (x <= m.urcrnrx) & (y >= m.llcrnry) & (y <= m.urcrnry)
+            save_arrays(paths, (x, y, mask))
+        _grids[key] = tuple(np.load(path, mmap_mode="r") for path in paths)
+    return _grids[key]
+
+
+# Function to get, for every pixel of a width x height image of a map (top row first), the flat index
+# of the nearest point of a regular lat/lon grid, -1 where the grid does not reach. Cached like project_grid.
+def pixel_index(m, name, lats, lons, width, height):
+    key = cache_key(MAPS[name], grid_hash(lats, lons), width, height)
+    if key not in _grids:
+        path = os.path.join(BASEMAP_FOLDER, f"{name}-pixels-{key}.npy")
+        if not os.path.exists(path):
+            x = m.llcrnrx + (np.arange(width) + 0.5) * (m.urcrnrx - m.llcrnrx) / width
+            y = m.urcrnry - (np.arange(height) + 0.5) * (m.urcrnry - m.llcrnry) / height
+            pixel_lons, pixel_lats = m(*np.meshgrid(x, y), inverse=True)
+            pixel_lons = (np.asarray(pixel_lons) + 180) % 360 - 180
+            rows = np.rint((pixel_lats - lats[0]) / (lats[1] - lats[0])).astype(np.int64)
+            cols = np.rint((pixel_lons - lons[0]) / (lons[1] - lons[0])).astype(np.int64)
+            inside = (rows >= 0) & (rows < len(lats)) & (cols >= 0) & (cols < len(lons))
+            save_arrays([path], [np.where(inside, rows * len(lons) + cols, -1).astype(np.int32)])
+        _grids[key] = np.load(path, mmap_mode="r")
+    return _grids[key]
@@ -0,0 +1,163 @@
+import json
+import os
+import re
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from gfs import manifest, render, variants
+
+# Catalog of what the web app shows: the files of each gallery folder, sorted by forecast hour.
+# Each product script publishes its folder once per run (publish) as CATALOG_FOLDER/<name>.json,
+# and the web app keeps the catalog in memory (Catalog), only reading a file again once it changed.
+CATALOG_FOLDER = os.path.join("public", "catalog")
+
+# Files listed in the gallery: frames and animations, and the videos some products also write
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.webp', '.apng')
+VIDEO_EXTENSIONS = ('.mp4', '.webm')
+
+# Forecast step in a frame name, e.g. temperature_12_f006.png
+STEP = re.compile(r"_f(\d{3})\b")
+
+# How often, in seconds, the web app looks for a newer catalog of a product.
+# It can be overridden with the GFS_CATALOG_INTERVAL variable.
+CHECK_INTERVAL = float(os.environ.get("GFS_CATALOG_INTERVAL", "10"))
+
+
+# Function to get the catalog file of a gallery folder
+def catalog_path(name):
+    return os.path.join(CATALOG_FOLDER, f"{name}.json")
+
+
+# Function to get the forecast hour of a frame from its name, None for animations
+def forecast_hour(filename):
+    match = STEP.search(filename)
+    return int(match.group(1)) if match else None
+
+
+# Function to list the gallery files of a folder: the animations first, then the frames by forecast hour.
+# With checksums each file also gets the sha256 of its content, its fingerprint in the web app's URLs.
+def scan(folder, checksums=False):
+    files = []
+    if not os.path.isdir(folder):
+        return files
+    for entry in os.scandir(folder):
+        if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS + VIDEO_EXTENSIONS):
+            stat = entry.stat()
+            file = {"name": entry.name, "hour": forecast_hour(entry.name), "size": stat.st_size,
+                    "modified": stat.st_mtime}
+            if checksums:
+                file["sha256"] = manifest.file_checksum(entry.path)
+            files.append(file)
+    files.sort(key=lambda file: (file["hour"] is not None, file["hour"] or 0, file["name"]))
+    return files
+
+
+# Function to publish the catalog of a gallery folder once a product script has written its files.
+# The variants of its still frames (gfs.variants) are written first, in parallel like the frames.
+def publish(name, folder, run=None):
+    files = scan(folder, checksums=True)
+    stills = [file for file in files if file["name"].lower().endswith(variants.STILL_EXTENSIONS)]
+    for file, (width, entries) in zip(stills, render.iter_frames(variants.write_variants,
+                                                                  [(folder, file["name"]) for file in stills])):
+        file["width"] = width
+        file["variants"] = entries
+    variants.prune(folder, [entry["name"] for file in stills for entry in file["variants"]])
+    product = {"name": name, "run": run, "published": time.time(), "files": files}
+    os.makedirs(CATALOG_FOLDER, exist_ok=True)
+    path = catalog_path(name)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w') as file:
+        json.dump(product, file, indent=1)
+    os.replace(temp_path, path)
+    print(f"Catalog published: {path} ({len(product['files'])} files)")
+    return path
+
+
+# Function to get the fingerprint of a catalog file entry: the start of its sha256, or of its size and
+# modification time for folders that were scanned instead of published
+def fingerprint(file):
+    if "sha256" in file:
+        return file["sha256"][:16]
+    return f"{file['size']:x}{int(file['modified'] * 1000):x}"
+
+
+# Function to get the initialization time of a run like 2025030212, None for no run
+def run_time(run):
+    if not run:
+        return None
+    return datetime.strptime(run, "%Y%m%d%H").replace(tzinfo=timezone.utc)
+
+
+# Function to get the time a forecast hour of a run is valid at, None if either is unknown
+def valid_time(run, hour):
+    if not run or hour is None:
+        return None
+    return run_time(run) + timedelta(hours=hour)
+
+
+# Function to write a time (datetime or POSIX timestamp) in ISO 8601 UTC, None stays None
+def iso_time(value):
+    if value is None:
+        return None
+    if not isinstance(value, datetime):
+        value = datetime.fromtimestamp(value, timezone.utc)
+    return value.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+# Function to get what identifies the current version of a file, None if it is missing
+def file_stamp(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class Catalog:
+    # In-memory catalog of the gallery folders, given as {name: folder}. A product is read from its
+    # published catalog file, at most once every check_interval seconds and only when the file changed.
+    # Folders whose product was not published yet are scanned instead, at the same pace.
+    def __init__(self, folders, check_interval=CHECK_INTERVAL):
+        self.folders = folders
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.products = {}
+        self.checked = {}
+
+    # Get the catalog of a gallery folder, None for unknown names
+    def product(self, name):
+        if name not in self.folders:
+            return None
+        now = time.monotonic()
+        with self.lock:
+            cached = self.products.get(name)
+            if cached is not None and now - self.checked[name] < self.check_interval:
+                return cached[1]
+            self.checked[name] = now
+            stamp = file_stamp(catalog_path(name))
+            if cached is not None and stamp is not None and stamp == cached[0]:
+                return cached[1]
+            product = self.load(name, stamp)
+            self.products[name] = (stamp, product, {file["name"]: file for file in product["files"]})
+            return product
+
+    def load(self, name, stamp):
+        if stamp is not None:
+            try:
+                with open(catalog_path(name)) as file:
+                    return json.load(file)
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable catalog {catalog_path(name)}: {e}")
+        return {"name": name, "run": None, "published": None, "files": scan(self.folders[name])}
+
+    # Get the catalog entry of one file of a gallery folder, None if it is not listed
+    def file(self, name, filename):
+        if self.product(name) is None:
+            return None
+        return self.products[name][2].get(filename)
+
+    # Get the names of the files of a gallery folder, in catalog order
+    def files(self, name):
+        product = self.product(name)
+        return [] if product is None else [file["name"] for file in product["files"]]
@@ -0,0 +1,217 @@
+import hashlib
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from gfs import grib_idx, regions
+from gfs.manifest import file_digest, partial_path
+
+NOMADS_URL = "https://nomads.ncep.noaa.gov"
+# Directory holding the raw GFS files and their .idx inventories (static files, no CGI work).
+# GFS_DATA_URL can point this at a mirror or at the local stand-in in gfs/standin.py.
+DATA_URL = os.environ.get("GFS_DATA_URL", f"{NOMADS_URL}/pub/data/nccf/com/gfs/prod")
+
+# How fields are fetched: "filter" asks the NOMADS filter CGI to subset the file,
+# "idx" reads the .idx inventory and downloads only the byte ranges of the wanted fields
+BACKEND = os.environ.get("GFS_BACKEND", "filter")
+
+# GRIB fields as (variable, level) pairs, named as in the .idx inventories
+TMP_2M = ("TMP", "2 m above ground")
+REFC = ("REFC", "entire atmosphere")
+PRMSL = ("PRMSL", "mean sea level")
+MSLET = ("MSLET", "mean sea level")
+# Categorical precipitation types (1 where the type falls), missing from the f000 files
+CRAIN = ("CRAIN", "surface")
+CSNOW = ("CSNOW", "surface")
+CICEP = ("CICEP", "surface")
+CFRZR = ("CFRZR", "surface")
+PRECIP_TYPES = (CRAIN, CSNOW, CICEP, CFRZR)
+
+# Size of the pieces downloads are written to disk in
+CHUNK_SIZE = 1024 * 1024
+
+# The download of some fields of one forecast step. run is "YYYYMMDDHH" and
+# backend says how url is read ("filter" for a plain GET, "idx" for byte ranges).
+StepRequest = namedtuple("StepRequest", ["run", "step", "fields", "url", "backend"])
+
+# Maximum number of simultaneous requests to NOMADS. Keep this small so we stay
+# under their rate limit; it can be overridden with the GFS_MAX_WORKERS variable.
+MAX_WORKERS = int(os.environ.get("GFS_MAX_WORKERS", "4"))
+
+_session = None
+
+
+# Function to create an HTTP session with a keep-alive connection pool
+def make_session(max_workers=MAX_WORKERS):
+    session = requests.Session()
+    retry = Retry(total=3, backoff_factor=2, status_forcelist=[429, 500, 502, 503, 504],
+                  allowed_methods=["HEAD", "GET"])
+    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=max_workers, pool_block=True, max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+# Function to get the session shared by every download in this process
+def get_session():
+    global _session
+    if _session is None:
+        _session = make_session()
+    return _session
+
+
+# Function to build a NOMADS filter URL for one forecast step
+def filter_url(date_str, hour, step, variables, levels, resolution="0p25"):
+    params = "".join(f"&var_{variable}=on" for variable in variables)
+    params += "".join(f"&lev_{level}=on" for level in levels)
+    return (f"{NOMADS_URL}/cgi-bin/filter_gfs_{resolution}.pl?dir=%2Fgfs.{date_str}%2F{hour}%2Fatmos"
+            f"&file=gfs.t{hour}z.pgrb2.{resolution}.{step}{params}")
+
+
+# Function to build the URL of the raw GRIB2 file for one forecast step
+def raw_url(date_str, hour, step, resolution="0p25"):
+    return f"{DATA_URL}/gfs.{date_str}/{hour}/atmos/gfs.t{hour}z.pgrb2.{resolution}.{step}"
+
+
+# Function to build the URL of the .idx inventory for one forecast step
+def inventory_url(date_str, hour, step, resolution="0p25"):
+    return raw_url(date_str, hour, step, resolution) + ".idx"
+
+
+# Function to describe the download of some (variable, level) fields of one forecast step
+# with the configured backend. The result is passed to fetch() / download_groups().
+# With a region (gfs.regions.Region) the filter backend only sends that lat/lon box;
+# byte ranges cannot cut a GRIB message, so the idx backend always gets the whole grid.
+def step_request(date_str, hour, step, fields, resolution="0p25", backend=None, region=None):
+    backend = backend or BACKEND
+    if backend == "idx":
+        url = raw_url(date_str, hour, step, resolution)
+    else:
+        variables = list(dict.fromkeys(variable for variable, _ in fields))
+        levels = list(dict.fromkeys(level.replace(" ", "_") for _, level in fields))
+        url = filter_url(date_str, hour, step, variables, levels, resolution)
+        if region is not None:
+            url += regions.subregion_params(region)
+    return StepRequest(f"{date_str}{hour}", step, tuple(fields), url, backend)
+
+
+# Function to list the most recent GFS runs as (date_str, hour_str), newest first
+def recent_runs(now=None, count=2):
+    now = now or datetime.now(timezone.utc)
+    cycle = now.replace(hour=(now.hour // 6) * 6, minute=0, second=0, microsecond=0)
+    runs = [cycle - timedelta(hours=6 * i) for i in range(count)]
+    return [(run.strftime("%Y%m%d"), run.strftime("%H")) for run in runs]
+
+
+# Function to check once whether a whole run is on the server. NOMADS publishes the
+# steps in order, so a run is complete when the inventory of its last step exists.
+def run_available(session, date_str, hour, last_step, resolution="0p25"):
+    try:
+        return session.head(inventory_url(date_str, hour, last_step, resolution)).status_code == 200
+    except requests.RequestException as e:
+        print(f"Error checking run {date_str} {hour}z: {e}")
+        return False
+
+
+# Function to find the most recent complete run, returns (date_str, hour_str) or None
+def find_run(last_step, resolution="0p25", now=None, session=None):
+    session = session or get_session()
+    for date_str, hour in recent_runs(now):  # Try current and past run
+        if run_available(session, date_str, hour, last_step, resolution):
+            return date_str, hour
+    return None
+
+
+# Function to stream a URL into a partial file in CHUNK_SIZE pieces. A partial file left by an
+# interrupted attempt is continued with a Range request when the server honours it.
+# Returns the sha256 checksum of the partial file once the whole body is on disk, else None.
+def fetch_url(session, url, partial):
+    offset = os.path.getsize(partial) if os.path.exists(partial) else 0
+    headers = {"Range": f"bytes={offset}-"} if offset else {}
+    try:
+        with session.get(url, headers=headers, stream=True) as response:
+            if response.status_code == 416 and offset:
+                return file_digest(partial).hexdigest()  # The partial file already holds the whole body
+            if response.status_code not in (200, 206):
+                print(f"Failed to download {url}. Status code: {response.status_code}")
+                return None
+            expected = response.headers.get("Content-Length")
+            if response.headers.get("Content-Encoding"):
+                expected = None  # That length is of the encoded body, not of what we write
+            # A 200 answer means the server started over, so does the partial file
+            appending = response.status_code == 206
+            digest = file_digest(partial) if appending else hashlib.sha256()
+            written = 0
+            with open(partial, 'ab' if appending else 'wb') as file:
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    file.write(chunk)
+                    digest.update(chunk)
+                    written += len(chunk)
+                file.flush()
+                os.fsync(file.fileno())
+    except requests.RequestException as e:
+        print(f"Failed to download {url}: {e}")
+        return None
+    if expected is not None and written != int(expected):
+        print(f"Incomplete download of {url}: got {written} of {expected} bytes")
+        return None
+    return digest.hexdigest()
+
+
+# Function to download a single file, returns its sha256 checksum on success or None.
+# The file only appears under its final name once it is complete (and, for GRIB requests,
+# made of whole GRIB messages), so a crash never leaves a truncated file for the renderers.
+def fetch(session, request, filename):
+    if not isinstance(request, StepRequest):
+        partial = partial_path(filename)
+        checksum = fetch_url(session, request, partial)
+    else:
+        partial = partial_path(filename, request.run)
+        if request.backend == "idx":
+            checksum = grib_idx.fetch_fields(session, request.url, request.fields, partial)
+        else:
+            checksum = fetch_url(session, request.url, partial)
+        if checksum is not None and not grib_idx.check_grib(partial):
+            print(f"Discarding {filename}: the download is not a complete GRIB file")
+            os.remove(partial)
+            checksum = None
+    if checksum is None:
+        print(f"Failed to download {filename}")
+        return None
+    os.replace(partial, filename)
+    print(f"Downloaded: {filename}")
+    return checksum
+
+
+# Function to download a group of files that belong together (e.g. every variable of one step).
+# Each file is a single GET, a non-200 answer simply counts as missing. Files the manifest
+# already holds for this run, with every field asked for, are skipped; new ones are recorded in it.
+def fetch_group(session, group, manifest=None):
+    results = []
+    for request, filename in group:
+        tracked = manifest is not None and isinstance(request, StepRequest)
+        if tracked and manifest.is_complete(filename, request.run, request.fields):
+            print(f"Already downloaded: {filename}")
+            results.append(True)
+            continue
+        checksum = fetch(session, request, filename)
+        if checksum is not None and tracked:
+            manifest.record(filename, request.run, request.step, request.fields, checksum)
+        results.append(checksum is not None)
+    return all(results)
+
+
+# Function to download many groups in parallel over one pooled session.
+# Returns a list of booleans in the same order as the groups.
+def download_groups(groups, manifest=None, max_workers=MAX_WORKERS, session=None):
+    session = session or get_session()
+    # Duplicate groups (e.g. a step listed twice) would write the same file from two threads
+    unique = list(dict.fromkeys(tuple(group) for group in groups))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = dict(zip(unique, executor.map(lambda group: fetch_group(session, group, manifest), unique)))
+    return [results[tuple(group)] for group in groups]
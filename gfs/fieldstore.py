@@ -0,0 +1,177 @@
+import json
+import os
+import shutil
+from collections import namedtuple
+
+import numpy as np
+
+# Decoded fields, written once by the ingest stage and read by every renderer.
+# Layout: FIELD_FOLDER/<run>/<resolution>/
+#   latitude.npy, longitude.npy   coordinates of the grid, stored once
+#   <VAR>_<level>.npy             float32 array of shape (steps, latitude, longitude), NaN until decoded
+#   store.json                    the steps of the run and the checksum each step was decoded from
+# Longitudes are -180..180 in increasing order so a lat/lon box is a plain slice of the arrays.
+FIELD_FOLDER = os.path.join("public", "grib", "fields")
+
+# One field of one step: values[latitude, longitude] with the coordinates it is on
+Field = namedtuple("Field", ["values", "lats", "lons"])
+
+
+# Function to get the file name of a (variable, level) field, e.g. TMP_2_m_above_ground
+def field_name(field):
+    return "_".join(field).replace(" ", "_")
+
+
+# Function to get the folder holding one grid of a run
+def grid_folder(run, resolution):
+    return os.path.join(FIELD_FOLDER, run, resolution)
+
+
+# Function to read the store.json of a grid, returns None if there is none
+def read_info(folder):
+    try:
+        with open(os.path.join(folder, "store.json")) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def write_info(folder, info):
+    temp_path = os.path.join(folder, "store.json.tmp")
+    with open(temp_path, 'w') as file:
+        json.dump(info, file, indent=1, sort_keys=True)
+    os.replace(temp_path, os.path.join(folder, "store.json"))
+
+
+# Memory-mapped arrays already opened in this process, by path, with the file they were opened from
+_arrays = {}
+
+
+# Function to open a stored array memory-mapped, once per process for as long as its file is not replaced
+def open_array(path):
+    stat = os.stat(path)
+    key = (stat.st_ino, stat.st_size)
+    cached = _arrays.get(path)
+    if cached is None or cached[0] != key:
+        cached = (key, np.load(path, mmap_mode="r"))
+        _arrays[path] = cached
+    return cached[1]
+
+
+# Function to get the newest run in the store, None if it is empty
+def latest_run():
+    if not os.path.isdir(FIELD_FOLDER):
+        return None
+    return max((name for name in os.listdir(FIELD_FOLDER) if name.isdigit()), default=None)
+
+
+# Function to delete the stored fields of every run but the given one
+def prune(run):
+    if not os.path.isdir(FIELD_FOLDER):
+        return
+    for name in os.listdir(FIELD_FOLDER):
+        if name != run:
+            shutil.rmtree(os.path.join(FIELD_FOLDER, name), ignore_errors=True)
+
+
+# Function to check whether a field of a step was already decoded from a GRIB file with this checksum
+def is_stored(run, resolution, step, field, checksum):
+    info = read_info(grid_folder(run, resolution))
+    return info is not None and info["fields"].get(field_name(field), {}).get(step) == checksum
+
+
+# Function to decode one field of one step into the store. dataset is the xarray Dataset holding
+# only that field, steps lists every step of the run and checksum is the GRIB file's sha256.
+def store(run, resolution, steps, step, field, dataset, checksum):
+    folder = grid_folder(run, resolution)
+    os.makedirs(folder, exist_ok=True)
+    info = read_info(folder)
+    if info is None or info["steps"] != list(steps):
+        # New run or different steps: start this grid over
+        for name in os.listdir(folder):
+            os.remove(os.path.join(folder, name))
+        info = {"steps": list(steps), "fields": {}}
+
+    values = next(iter(dataset.data_vars.values())).values
+    lats = dataset["latitude"].values
+    lons = (dataset["longitude"].values + 180) % 360 - 180
+    order = np.argsort(lons, kind="stable")
+    if not info["fields"]:
+        np.save(os.path.join(folder, "latitude.npy"), lats.astype(np.float32))
+        np.save(os.path.join(folder, "longitude.npy"), lons[order].astype(np.float32))
+
+    name = field_name(field)
+    path = os.path.join(folder, f"{name}.npy")
+    if os.path.exists(path):
+        array = np.load(path, mmap_mode="r+")
+    else:
+        array = np.lib.format.open_memmap(path, mode="w+", dtype=np.float32,
+                                          shape=(len(steps), len(lats), len(lons)))
+        array[:] = np.nan
+    array[list(steps).index(step)] = values[:, order]
+    array.flush()
+    del array
+
+    info["fields"].setdefault(name, {})[step] = checksum
+    write_info(folder, info)
+
+
+# Function to get one field of one step as a Field of memory-mapped arrays, or None if it was
+# not stored. With a region (gfs.regions.Region) only that box is returned; nothing is copied.
+def load(run, step, field, resolution="0p25", region=None):
+    folder = grid_folder(run, resolution)
+    info = read_info(folder)
+    if info is None or step not in info["fields"].get(field_name(field), {}):
+        return None
+    lats = np.load(os.path.join(folder, "latitude.npy"), mmap_mode="r")
+    lons = np.load(os.path.join(folder, "longitude.npy"), mmap_mode="r")
+    values = np.load(os.path.join(folder, f"{field_name(field)}.npy"), mmap_mode="r")[info["steps"].index(step)]
+    if region is None:
+        return Field(values, lats, lons)
+    lat_index = np.nonzero((lats >= region.south) & (lats <= region.north))[0]
+    lon_index = np.nonzero((lons >= region.west) & (lons <= region.east))[0]
+    lat_slice = slice(lat_index[0], lat_index[-1] + 1)
+    lon_slice = slice(lon_index[0], lon_index[-1] + 1)
+    return Field(values[lat_slice, lon_slice], lats[lat_slice], lons[lon_slice])
+
+
+# Function to get the fractional index of a coordinate on a regular axis, None outside it
+def axis_position(axis, value):
+    position = (value - float(axis[0])) / (float(axis[1]) - float(axis[0]))
+    if not 0 <= position <= len(axis) - 1:
+        return None
+    return position
+
+
+# Function to read fields at one point for every step of a run, one memory-mapped read per field:
+# the nearest cell, or with "bilinear" the four cells around the point weighted by distance.
+# Returns (steps, {field: float64 array over the steps}), NaN for steps not decoded and fields not
+# stored left out, or None when the grid is not stored or the point is outside it.
+def point_series(run, resolution, fields, lat, lon, method="nearest"):
+    folder = grid_folder(run, resolution)
+    info = read_info(folder)
+    if info is None or not info["fields"]:
+        return None
+    lats = open_array(os.path.join(folder, "latitude.npy"))
+    lons = open_array(os.path.join(folder, "longitude.npy"))
+    row, col = axis_position(lats, lat), axis_position(lons, lon)
+    if row is None or col is None:
+        return None
+    if method == "bilinear":
+        row0, col0 = min(int(row), len(lats) - 2), min(int(col), len(lons) - 2)
+        row_weight, col_weight = row - row0, col - col0
+        weights = np.array([[(1 - row_weight) * (1 - col_weight), (1 - row_weight) * col_weight],
+                            [row_weight * (1 - col_weight), row_weight * col_weight]])
+        window = (slice(None), slice(row0, row0 + 2), slice(col0, col0 + 2))
+    else:
+        weights = None
+        window = (slice(None), round(row), round(col))
+
+    values = {}
+    for field in fields:
+        name = field_name(field)
+        if name not in info["fields"]:
+            continue
+        series = np.asarray(open_array(os.path.join(folder, f"{name}.npy"))[window], dtype=np.float64)
+        values[field] = series if weights is None else np.einsum("sij,ij->s", series, weights)
+    return info["steps"], values
@@ -0,0 +1,279 @@
+import io
+import os
+import struct
+from collections import namedtuple
+
+import requests
+
+from gfs.manifest import file_digest
+
+# Size of the pieces byte ranges are copied to disk in
+CHUNK_SIZE = 1024 * 1024
+
+# One line of a wgrib2 style inventory; end is None for the last message (read to EOF)
+InventoryEntry = namedtuple("InventoryEntry", ["number", "start", "end", "variable", "level", "forecast"])
+
+# Parameter names for meteorological products (discipline 0), keyed by (category, number)
+PARAMETERS = {
+    (0, 0): "TMP",
+    (1, 1): "RH",
+    (1, 7): "PRATE",
+    (1, 8): "APCP",
+    (1, 39): "CPOFP",
+    (1, 192): "CRAIN",
+    (1, 193): "CFRZR",
+    (1, 194): "CICEP",
+    (1, 195): "CSNOW",
+    (2, 2): "UGRD",
+    (2, 3): "VGRD",
+    (3, 0): "PRES",
+    (3, 1): "PRMSL",
+    (3, 5): "HGT",
+    (3, 192): "MSLET",
+    (16, 196): "REFC",
+}
+
+# Statistical processes of template 4.8 products, as wgrib2 names them
+STATISTICS = {0: "ave", 1: "acc", 2: "max", 3: "min"}
+
+
+# Function to parse the text of a .idx inventory into a list of InventoryEntry
+def parse_inventory(text):
+    rows = []
+    for line in text.splitlines():
+        parts = line.split(":")
+        if len(parts) < 6:
+            continue
+        rows.append((int(parts[0]), int(parts[1]), parts[3], parts[4], parts[5]))
+    entries = []
+    for i, (number, start, variable, level, forecast) in enumerate(rows):
+        end = rows[i + 1][1] - 1 if i + 1 < len(rows) else None
+        entries.append(InventoryEntry(number, start, end, variable, level, forecast))
+    return entries
+
+
+# Function to tell an instant value ("anl", "6 hour fcst") from a statistic over a period ("0-6 hour ave fcst")
+def is_instant(entry):
+    return entry.forecast == "anl" or entry.forecast.split()[0].isdigit()
+
+
+# Function to pick the inventory entries matching the requested (variable, level) pairs.
+# Fields written both as an instant value and as an average over the period, like the categorical
+# precipitation types, only get their instant message, the one gfs.ingest decodes.
+def select_entries(entries, fields):
+    wanted = set(fields)
+    matching = [entry for entry in entries if (entry.variable, entry.level) in wanted]
+    instant = {(entry.variable, entry.level) for entry in matching if is_instant(entry)}
+    return [entry for entry in matching if is_instant(entry) or (entry.variable, entry.level) not in instant]
+
+
+# Function to merge touching or overlapping byte ranges into as few ranges as possible
+def coalesce_ranges(ranges):
+    merged = []
+    for start, end in sorted(ranges, key=lambda r: r[0]):
+        if merged and merged[-1][1] is None:
+            break  # The previous range already reads to the end of the file
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], None if end is None else max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+# Function to format ranges for an HTTP Range header
+def range_header(ranges):
+    return "bytes=" + ",".join(f"{start}-" if end is None else f"{start}-{end}" for start, end in ranges)
+
+
+# Function to copy exactly size bytes from a reader to a file in CHUNK_SIZE pieces
+def copy_bytes(reader, file, digest, size):
+    while size > 0:
+        chunk = reader.read(min(size, CHUNK_SIZE))
+        if not chunk:
+            return False
+        file.write(chunk)
+        digest.update(chunk)
+        size -= len(chunk)
+    return True
+
+
+# Function to parse "bytes start-end/total" into (start, end)
+def parse_content_range(value):
+    start, end = value.split()[-1].split("/")[0].split("-")
+    return int(start), int(end)
+
+
+# Function to stream the parts of a multipart/byteranges response to a file. The parts
+# must come back in the order they were asked for, which is the order of the file.
+def copy_multipart(response, ranges, file, digest):
+    boundary = b"--" + response.headers["Content-Type"].split("boundary=")[1].strip('"').encode()
+    reader = io.BufferedReader(response.raw, CHUNK_SIZE)
+    for expected_start, _ in ranges:
+        line = reader.readline()
+        while line.strip() == b"":
+            if not line:
+                return False
+            line = reader.readline()
+        if line.strip() != boundary:
+            return False
+        content_range = None
+        line = reader.readline()
+        while line.strip():
+            name, _, value = line.decode("latin-1").partition(":")
+            if name.strip().lower() == "content-range":
+                content_range = value.strip()
+            line = reader.readline()
+        if content_range is None:
+            return False
+        start, end = parse_content_range(content_range)
+        if start != expected_start or not copy_bytes(reader, file, digest, end - start + 1):
+            return False
+    return True
+
+
+# Function to stream byte ranges of a file, in order, to an open file. Returns True on success.
+# Servers that answer a multi-range request with the whole file are asked range by range.
+def write_ranges(session, url, ranges, file, digest):
+    with session.get(url, headers={"Range": range_header(ranges)}, stream=True) as response:
+        if response.status_code == 206:
+            if response.headers.get("Content-Type", "").startswith("multipart/byteranges"):
+                return copy_multipart(response, ranges, file, digest)
+            start, end = parse_content_range(response.headers["Content-Range"])
+            if len(ranges) != 1 or start != ranges[0][0]:
+                return False
+            return copy_bytes(response.raw, file, digest, end - start + 1)
+        if response.status_code != 200 or len(ranges) == 1:
+            return False
+    # The whole file was coming back, so it was dropped unread; go range by range instead
+    return all(write_ranges(session, url, [byte_range], file, digest) for byte_range in ranges)
+
+
+# Function to drop the part of the ranges already written to a partial file of the given size
+def remaining_ranges(ranges, written):
+    remaining = []
+    for start, end in ranges:
+        length = None if end is None else end - start + 1
+        if length is not None and written >= length:
+            written -= length
+            continue
+        remaining.append((start + written, end))
+        written = 0
+    return remaining
+
+
+# Function to download the requested (variable, level) fields of a GRIB2 file into a partial file.
+# The messages are appended in order, so an interrupted download resumes where it stopped.
+# Returns the sha256 checksum of the partial file once it holds every field, else None.
+def fetch_fields(session, url, fields, partial):
+    try:
+        response = session.get(url + ".idx")
+        if response.status_code != 200:
+            print(f"Failed to download inventory {url}.idx. Status code: {response.status_code}")
+            return None
+        entries = select_entries(parse_inventory(response.text), fields)
+        if not entries:
+            print(f"None of the requested fields are in the inventory of {url}")
+            return None
+        ranges = coalesce_ranges([(entry.start, entry.end) for entry in entries])
+        written = os.path.getsize(partial) if os.path.exists(partial) else 0
+        ranges = remaining_ranges(ranges, written)
+        digest = file_digest(partial)
+        with open(partial, 'ab') as file:
+            ok = not ranges or write_ranges(session, url, ranges, file, digest)
+            file.flush()
+            os.fsync(file.fileno())
+    except requests.RequestException as e:
+        print(f"Failed to download {url}: {e}")
+        return None
+    if not ok:
+        print(f"Failed to download {url}. The server did not return the requested byte ranges")
+        return None
+    return digest.hexdigest()
+
+
+# Function to check that a file is made of whole GRIB messages, each ending with "7777"
+def check_grib(path):
+    size = os.path.getsize(path)
+    with open(path, 'rb') as file:
+        offset = 0
+        while offset < size:
+            file.seek(offset)
+            header = file.read(16)
+            if len(header) < 16 or header[:4] != b"GRIB":
+                return False
+            offset += struct.unpack(">Q", header[8:16])[0]
+            if offset > size:
+                return False
+            file.seek(offset - 4)
+            if file.read(4) != b"7777":
+                return False
+    return size > 0
+
+
+# Function to describe a fixed surface the way wgrib2 does
+def level_name(surface_type, value):
+    if surface_type == 1:
+        return "surface"
+    if surface_type == 10:
+        return "entire atmosphere"
+    if surface_type == 101:
+        return "mean sea level"
+    if surface_type == 103:
+        return f"{value:g} m above ground"
+    if surface_type == 100:
+        return f"{value / 100:g} mb"
+    return f"level type {surface_type}"
+
+
+# Function to list (start, variable, level, forecast, reference time) for every GRIB2 message in data
+def scan_messages(data):
+    messages = []
+    offset = data.find(b"GRIB")
+    while offset != -1 and offset + 16 <= len(data):
+        discipline = data[offset + 6]
+        total_length = struct.unpack(">Q", data[offset + 8:offset + 16])[0]
+        position = offset + 16
+        reference_time = variable = level = forecast = None
+        while position < offset + total_length - 4:
+            length, number = struct.unpack(">IB", data[position:position + 5])
+            section = data[position:position + length]
+            if number == 1:
+                year, month, day, hour = struct.unpack(">HBBB", section[12:17])
+                reference_time = f"{year:04d}{month:02d}{day:02d}{hour:02d}"
+            elif number == 4 and variable is None:
+                category, parameter = section[9], section[10]
+                variable = PARAMETERS.get((category, parameter)) if discipline == 0 else None
+                variable = variable or f"var{discipline}_{category}_{parameter}"
+                forecast_time = struct.unpack(">I", section[18:22])[0]
+                forecast = "anl" if forecast_time == 0 else f"{forecast_time} hour fcst"
+                # Template 4.8 is a statistic over a period starting at the forecast time
+                template = struct.unpack(">H", section[7:9])[0]
+                if template == 8 and length >= 53:
+                    process = STATISTICS.get(section[46], f"stat{section[46]}")
+                    period = struct.unpack(">I", section[49:53])[0]
+                    forecast = f"{forecast_time}-{forecast_time + period} hour {process} fcst"
+                scale = struct.unpack(">b", section[23:24])[0]
+                value = struct.unpack(">I", section[24:28])[0] / 10 ** scale
+                level = level_name(section[22], value)
+            position += length
+        messages.append((offset, variable, level, forecast, reference_time))
+        offset = data.find(b"GRIB", offset + total_length)
+    return messages
+
+
+# Function to build the text of a wgrib2 style inventory for GRIB2 data
+def make_inventory(data):
+    lines = []
+    for number, (start, variable, level, forecast, reference_time) in enumerate(scan_messages(data), 1):
+        lines.append(f"{number}:{start}:d={reference_time}:{variable}:{level}:{forecast}:")
+    return "\n".join(lines) + "\n"
+
+
+# Function to write the inventory next to a local GRIB2 file, returns the .idx path
+def write_inventory(path, idx_path=None):
+    idx_path = idx_path or os.path.splitext(path)[0] + ".idx"
+    with open(path, 'rb') as file:
+        inventory = make_inventory(file.read())
+    with open(idx_path, 'w') as file:
+        file.write(inventory)
+    return idx_path
@@ -0,0 +1,38 @@
+import os
+
+from gfs.manifest import Manifest, file_checksum
+
+# cfgrib writes a pickled message index next to every GRIB file it opens (the *.5b7b6.idx files).
+# Those pile up in the data folders and are rebuilt every cycle, so instead they are kept here,
+# named after the checksum of the GRIB file: a re-downloaded file with new data gets a new index,
+# and an unchanged file keeps its index across runs.
+INDEX_FOLDER = os.environ.get("GFS_INDEX_FOLDER", os.path.join(".cache", "cfgrib"))
+
+
+# Function to get the checksum of a GRIB file, from the manifest when it still matches the file
+def grib_checksum(path, manifest=None):
+    manifest = manifest or Manifest()
+    entry = manifest.files.get(os.path.normpath(path))
+    if entry is not None and os.path.getsize(path) == entry["size"]:
+        return entry["sha256"]
+    return file_checksum(path)
+
+
+# Function to get the indexpath argument for cfgrib. cfgrib fills in {short_hash} itself
+# (it depends on the keys the file is indexed by) so one file can have several indexes.
+def index_path(path, manifest=None):
+    os.makedirs(INDEX_FOLDER, exist_ok=True)
+    return os.path.join(INDEX_FOLDER, f"{grib_checksum(path, manifest)}.{{short_hash}}.idx")
+
+
+# Function to delete the indexes of GRIB files that are no longer in the manifest
+def prune(manifest):
+    if not os.path.isdir(INDEX_FOLDER):
+        return
+    keep = {entry["sha256"] for entry in manifest.files.values()}
+    for name in os.listdir(INDEX_FOLDER):
+        if name.split(".")[0] not in keep:
+            try:
+                os.remove(os.path.join(INDEX_FOLDER, name))
+            except OSError as e:
+                print(f"Error deleting {name}: {e}")
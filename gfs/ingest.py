@@ -0,0 +1,204 @@
+import os
+from contextlib import contextmanager
+
+import xarray as xr
+
+from gfs import download, fieldstore, gribindex, regions
+from gfs.manifest import Manifest
+
+# File locks are only available on Unix, where the scripts run in production
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Shared ingest stage: every product registers the fields it needs, and each forecast step
+# is fetched once per grid with the union of those fields into a single cached file.
+# Run it on its own with "python -m gfs.ingest", the product scripts also call it first.
+GRIB_CACHE_FOLDER = os.path.join("public", "grib", "gfs")
+
+# Lock file held while a process ingests, so product scripts started together do not write the
+# same partial files, manifest and field store at once. It sits next to the manifest, outside the
+# cache folder the manifest prunes.
+LOCK_PATH = os.path.join("public", "grib", "ingest.lock")
+
+# Forecast steps f000 to f012 hourly, then every 6 hours up to f096
+FORECAST_STEPS = [f"f{str(i).zfill(3)}" for i in range(13)]
+FORECAST_STEPS += [f"f{str(i).zfill(3)}" for i in range(18, 97, 6)]
+
+# Hours between the steps each grid is published at, the 1p00 grid has no f001, f002, f004...
+STEP_INTERVALS = {"0p25": 1, "1p00": 3}
+
+# Fields needed by each product, the grid they are read from and the map area (gfs.regions.MAPS) they draw.
+# halo is the number of grid cells around the map the product's filters read (gfs.regions.filter_halo).
+PRODUCTS = {
+    "temperature": {"resolution": "0p25", "fields": [download.TMP_2M], "map": "conus"},
+    "rainsnow_usa": {"resolution": "0p25", "fields": [download.TMP_2M, download.REFC, *download.PRECIP_TYPES],
+                     "map": "usa"},
+    "rainsnow_northeast": {"resolution": "0p25", "fields": [download.TMP_2M, download.REFC, *download.PRECIP_TYPES],
+                           "map": "northeast"},
+    "mslp": {"resolution": "1p00", "fields": [download.PRMSL, download.MSLET], "map": "north_america",
+             # Smoothing and center search of the MSLP scripts
+             "halo": regions.filter_halo(sigma=2, size=10)},
+}
+
+# cfgrib keys selecting one field out of a file that holds several. The precipitation types are
+# also written as an average over the period next to the instant value, only the instant one is used.
+FILTER_KEYS = {
+    download.TMP_2M: {"shortName": "2t"},
+    download.REFC: {"shortName": "refc"},
+    download.PRMSL: {"shortName": "prmsl"},
+    download.MSLET: {"shortName": "mslet"},
+    download.CRAIN: {"shortName": "crain", "stepType": "instant"},
+    download.CSNOW: {"shortName": "csnow", "stepType": "instant"},
+    download.CICEP: {"shortName": "cicep", "stepType": "instant"},
+    download.CFRZR: {"shortName": "cfrzr", "stepType": "instant"},
+}
+
+
+# Function to get the path of the cached GRIB file for one step of a run
+def grib_path(hour_str, step, resolution="0p25"):
+    return os.path.join(GRIB_CACHE_FOLDER, f"gfs.t{hour_str}z.pgrb2.{resolution}.{step}.grib2")
+
+
+# Function to get the steps a grid is published at out of steps
+def grid_steps(resolution, steps=FORECAST_STEPS):
+    return [step for step in steps if int(step[1:]) % STEP_INTERVALS.get(resolution, 1) == 0]
+
+
+# Function to get the steps a product can draw out of steps, the ones its grid is published at
+def product_steps(name, steps=FORECAST_STEPS):
+    return grid_steps(PRODUCTS[name]["resolution"], steps)
+
+
+# Function to get the union of the fields needed by the products, grouped by grid
+def fields_by_resolution(products=None):
+    fields = {}
+    for name in products or PRODUCTS:
+        product = PRODUCTS[name]
+        resolution_fields = fields.setdefault(product["resolution"], [])
+        resolution_fields += [field for field in product["fields"] if field not in resolution_fields]
+    return fields
+
+
+# Function to get the spacing in degrees of a grid, e.g. 0.25 for "0p25"
+def grid_spacing(resolution):
+    return float(resolution.replace("p", "."))
+
+
+# Function to get the lat/lon box a product needs: its map plus the wider of the contour margin
+# and the halo its filters read, so everything is computed on this box only
+def product_region(name):
+    product = PRODUCTS[name]
+    margin = max(regions.MARGIN, product.get("halo", 0) * grid_spacing(product["resolution"]))
+    return regions.map_region(product["map"], margin)
+
+
+# Function to get the box covering every product on each grid, so the shared files hold
+# what all of them draw and nothing else
+def region_by_resolution(products=None):
+    boxes = {}
+    for name in products or PRODUCTS:
+        boxes.setdefault(PRODUCTS[name]["resolution"], []).append(product_region(name))
+    return {resolution: regions.union(group) for resolution, group in boxes.items()}
+
+
+# Function to hold the ingest lock, waiting for another process to finish its ingest first.
+# The Manifest lock only covers the threads of one process.
+@contextmanager
+def ingest_lock(path=LOCK_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'a') as file:
+        if fcntl is not None:
+            fcntl.flock(file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(file, fcntl.LOCK_UN)
+
+
+# Function to fetch the latest run for all registered products.
+# Returns (date_str, hour_str) of the run, or None if no run is available.
+# Only one process ingests at a time; the others wait and then find the steps already on disk.
+def ingest(steps=FORECAST_STEPS):
+    with ingest_lock():
+        return ingest_run(steps)
+
+
+# Function to fetch one run for all registered products, called with the ingest lock held
+def ingest_run(steps):
+    run = download.find_run(steps[-1])
+    if run is None:
+        print("No valid GFS data was found for the specified runs.")
+        return None
+    date_str, hour_str = run
+
+    # One group per step holding one combined request per grid that publishes the step
+    groups = []
+    files = []
+    boxes = region_by_resolution()
+    for step in steps:
+        group = []
+        for resolution, fields in fields_by_resolution().items():
+            if step not in grid_steps(resolution, steps):
+                continue
+            request = download.step_request(date_str, hour_str, step, fields, resolution=resolution,
+                                            region=boxes[resolution])
+            filename = grib_path(hour_str, step, resolution)
+            group.append((request, filename))
+            files.append((request, filename, resolution))
+        groups.append(group)
+
+    # Only fetch what the manifest does not already hold for this run, and drop data from older runs
+    os.makedirs(GRIB_CACHE_FOLDER, exist_ok=True)
+    manifest = Manifest()
+    manifest.prune([GRIB_CACHE_FOLDER], f"{date_str}{hour_str}", [filename for group in groups for _, filename in group])
+    download.download_groups(groups, manifest=manifest)
+
+    # Decode every field once into the field store the renderers read from
+    fieldstore.prune(f"{date_str}{hour_str}")
+    for request, filename, resolution in files:
+        if os.path.exists(filename):
+            decode(request, filename, resolution, grid_steps(resolution, steps), manifest)
+    gribindex.prune(manifest)
+    return run
+
+
+# Function to decode the fields of one downloaded file into the field store,
+# skipping the ones already decoded from a file with the same checksum
+def decode(request, filename, resolution, steps, manifest=None):
+    checksum = gribindex.grib_checksum(filename, manifest)
+    for field in request.fields:
+        if fieldstore.is_stored(request.run, resolution, request.step, field, checksum):
+            continue
+        try:
+            with open_dataset(filename, field, manifest=manifest) as dataset:
+                if not dataset.data_vars:
+                    # Not every step has every field, e.g. the precipitation types are missing at f000
+                    continue
+                fieldstore.store(request.run, resolution, steps, request.step, field, dataset, checksum)
+        except Exception as e:
+            raise RuntimeError(f"Error decoding {fieldstore.field_name(field)} from {filename}: {e}") from e
+
+
+# Function to load one field of one step of a run from the field store, cut to the box the product
+# draws. Returns a fieldstore.Field of memory-mapped arrays, or None if the step is missing.
+def load_field(run, step, field, product):
+    return fieldstore.load(run, step, field, PRODUCTS[product]["resolution"], product_region(product))
+
+
+# Function to open one field of a cached GRIB file as an xarray Dataset, using the index in gfs.gribindex.
+# Given a product name, only the box that product draws is kept, so only that part is decoded.
+def open_dataset(path, field, product=None, manifest=None):
+    indexpath = gribindex.index_path(path, manifest)
+    # cfgrib only reuses an index made for the same path string, so always pass an absolute one
+    dataset = xr.open_dataset(os.path.abspath(path), engine="cfgrib", backend_kwargs={
+        "filter_by_keys": FILTER_KEYS[field], "indexpath": indexpath})
+    if product is not None:
+        dataset = regions.crop(dataset, product_region(product))
+    return dataset
+
+
+if __name__ == '__main__':
+    ingest()
@@ -0,0 +1,104 @@
+import hashlib
+import json
+import os
+import threading
+
+# Manifest of every GRIB file downloaded so far, shared by all the product scripts
+MANIFEST_PATH = os.path.join("public", "grib", "manifest.json")
+
+
+# Function to start a sha256 digest over the current content of a file (empty if it is missing).
+# Downloads keep updating it as chunks arrive so the checksum costs no extra read.
+def file_digest(path):
+    digest = hashlib.sha256()
+    if os.path.exists(path):
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(1024 * 1024), b""):
+                digest.update(chunk)
+    return digest
+
+
+# Function to compute the sha256 checksum of a file
+def file_checksum(path):
+    return file_digest(path).hexdigest()
+
+
+# Name of the temporary file a download is written to before it is complete.
+# It carries the run so a later run never resumes a file started by an older one.
+def partial_path(filename, run=None):
+    return f"{filename}.{run}.part" if run else f"{filename}.part"
+
+
+# Function to get how fields, given as (variable, level) pairs, are written in the manifest
+def field_keys(fields):
+    return [f"{variable}:{level}" for variable, level in fields]
+
+
+class Manifest:
+    # Records run, step, fields, size and checksum of each downloaded file, keyed by path.
+    # Every change is written straight to disk so an interrupted ingest can pick up where it stopped.
+    def __init__(self, path=MANIFEST_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.files = {}
+        if os.path.exists(path):
+            try:
+                with open(path) as file:
+                    self.files = json.load(file).get("files", {})
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable manifest {path}: {e}")
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp_path = self.path + ".tmp"
+        with open(temp_path, 'w') as file:
+            json.dump({"files": self.files}, file, indent=1, sort_keys=True)
+        os.replace(temp_path, self.path)
+
+    # Check that a file was fully downloaded for this run, holds every field of fields (given as
+    # (variable, level) pairs) and has not changed since
+    def is_complete(self, filename, run, fields=None):
+        entry = self.files.get(os.path.normpath(filename))
+        if entry is None or entry["run"] != run or not os.path.isfile(filename):
+            return False
+        if fields is not None and not set(field_keys(fields)) <= set(entry["fields"]):
+            return False
+        if os.path.getsize(filename) != entry["size"]:
+            return False
+        return file_checksum(filename) == entry["sha256"]
+
+    def record(self, filename, run, step, fields, checksum=None):
+        entry = {
+            "run": run,
+            "step": step,
+            "fields": field_keys(fields),
+            "size": os.path.getsize(filename),
+            "sha256": checksum or file_checksum(filename),
+        }
+        with self.lock:
+            self.files[os.path.normpath(filename)] = entry
+            self.save()
+
+    # Delete everything in the folders that does not belong to the current run: files from
+    # older runs, files of unknown origin and unfinished downloads started by an older run.
+    # keep lists the files the current run is made of, their own partial files are kept.
+    def prune(self, folders, run, keep):
+        keep = {os.path.normpath(filename) for filename in keep}
+        keep |= {partial_path(filename, run) for filename in keep}
+        with self.lock:
+            for folder in folders:
+                if not os.path.isdir(folder):
+                    continue
+                for name in os.listdir(folder):
+                    path = os.path.normpath(os.path.join(folder, name))
+                    if not os.path.isfile(path):
+                        continue
+                    entry = self.files.get(path)
+                    if path in keep and (entry is None or entry["run"] == run):
+                        continue
+                    try:
+                        os.remove(path)
+                    except OSError as e:
+                        print(f"Error deleting {path}: {e}")
+                    self.files.pop(path, None)
+            self.save()
@@ -0,0 +1,84 @@
+import threading
+
+import numpy as np
+
+from gfs import catalog, download, fieldstore, ingest, ptype
+
+# Point forecasts read straight from the decoded fields (gfs.fieldstore): every step of a run at one
+# place, one memory-mapped read per field, for the /api/point endpoint of the web app.
+
+# Fields of a point forecast with the grid each is read from, the one the products draw them from
+POINT_FIELDS = [
+    (ingest.PRODUCTS["rainsnow_usa"]["resolution"], [download.TMP_2M, download.REFC, *download.PRECIP_TYPES]),
+    (ingest.PRODUCTS["mslp"]["resolution"], [download.PRMSL]),
+]
+
+# Values of "precip" in a point forecast, by gfs.ptype category; "none" is dry, null means not decoded
+PRECIP_VALUES = {ptype.NONE: "none", ptype.RAIN: "rain", ptype.SNOW: "snow", ptype.SLEET: "sleet",
+                 ptype.FREEZING_RAIN: "freezing_rain"}
+
+# Ways of reading a point between grid cells
+METHODS = ("nearest", "bilinear")
+
+# Reflectivity below the lowest level the maps color counts as no precipitation (GFS writes -20 dBZ
+# where there is no echo at all)
+MIN_ECHO_DBZ = 0
+
+# ptype.classify writes into buffers shared by the whole process, the web app calls it from several threads
+_classify_lock = threading.Lock()
+
+
+# Function to round a value for JSON, None for NaN
+def rounded(value, digits=1):
+    return None if np.isnan(value) else round(float(value), digits)
+
+
+# Function to get the forecast of every step of a run at one point: 2 m temperature (°F), composite
+# reflectivity (dBZ), precipitation type (one of PRECIP_VALUES) and mean sea level pressure (hPa),
+# None where a value is not available there. run defaults to the newest in the store; returns None
+# when the store is empty.
+def forecast(lat, lon, method="nearest", run=None):
+    run = run or fieldstore.latest_run()
+    if run is None:
+        return None
+    lon = (lon + 180) % 360 - 180
+
+    # Each grid has its own steps, the forecast covers all of them
+    columns = {}
+    for resolution, fields in POINT_FIELDS:
+        series = fieldstore.point_series(run, resolution, fields, lat, lon, method)
+        if series is not None:
+            grid_steps, grid_values = series
+            for field, field_values in grid_values.items():
+                columns[field] = dict(zip(grid_steps, field_values))
+    steps = sorted({step for column in columns.values() for step in column}, key=lambda step: int(step[1:]))
+
+    # Function to get the values of a field over the steps, NaN where it has none
+    def column(field):
+        return np.array([columns.get(field, {}).get(step, np.nan) for step in steps])
+
+    t2m, refc, mslp = column(download.TMP_2M), column(download.REFC), column(download.PRMSL)
+    if download.TMP_2M in columns and download.REFC in columns:
+        precip_types = [column(field) if field in columns else None for field in download.PRECIP_TYPES]
+        with _classify_lock:
+            category, _ = ptype.classify(t2m, np.where(refc >= MIN_ECHO_DBZ, refc, np.nan), *precip_types)
+            precip = [PRECIP_VALUES[kind] for kind in category]
+    else:
+        precip = [None] * len(steps)
+
+    return {
+        "run": run,
+        "initialized": catalog.iso_time(catalog.run_time(run)),
+        "lat": lat,
+        "lon": lon,
+        "method": method,
+        "steps": [{
+            "step": step,
+            "hour": int(step[1:]),
+            "valid": catalog.iso_time(catalog.valid_time(run, int(step[1:]))),
+            "t2m_f": rounded((t2m[i] - 273.15) * 9 / 5 + 32),
+            "refc_dbz": rounded(refc[i]),
+            "precip": precip[i] if not (np.isnan(t2m[i]) or np.isnan(refc[i])) else None,
+            "mslp_hpa": rounded(mslp[i] / 100),
+        } for i, step in enumerate(steps)],
+    }
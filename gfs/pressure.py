@@ -0,0 +1,63 @@
+from collections import namedtuple
+
+import numpy as np
+from scipy import ndimage
+
+# A high ("H") or low ("L") pressure center at grid cell (row, col). value is the pressure there
+# and prominence how far it stands out from the rest of its neighbourhood, both in hPa.
+Center = namedtuple("Center", ["kind", "row", "col", "value", "prominence"])
+
+# Colours of the center labels
+COLORS = {"H": "blue", "L": "red"}
+
+
+# Function to keep one cell of each flat run of tied extrema, ordered by prominence,
+# dropping centers closer than min_distance cells to a more prominent one of the same kind
+def pick_centers(kind, extrema, smoothed, values, prominence, min_prominence, min_distance):
+    labels, count = ndimage.label(extrema)
+    if count == 0:
+        return []
+    position = ndimage.minimum_position if kind == "L" else ndimage.maximum_position
+    cells = np.array(position(smoothed, labels, np.arange(1, count + 1)), dtype=int).reshape(-1, 2)
+    strength = prominence[cells[:, 0], cells[:, 1]]
+    keep = strength >= min_prominence
+    cells, strength = cells[keep], strength[keep]
+    order = np.argsort(-strength, kind="stable")
+    cells, strength = cells[order], strength[order]
+
+    # Greedy suppression over the few candidates left, most prominent first
+    distance = np.hypot(*(cells[:, None, :] - cells[None, :, :]).transpose(2, 0, 1))
+    accepted = np.zeros(len(cells), dtype=bool)
+    for i in range(len(cells)):
+        accepted[i] = not np.any(accepted[:i] & (distance[i, :i] < min_distance))
+    return [Center(kind, int(row), int(col), float(values[row, col]), float(p))
+            for (row, col), p in zip(cells[accepted], strength[accepted])]
+
+
+# Function to find the high and low pressure centers of a field with NumPy/SciPy passes only.
+# smoothed is the field the extrema are looked for in (e.g. gaussian filtered), values the one the
+# labels show, size the filter window in cells and mask (optional) the cells that may hold a center.
+def find_centers(smoothed, values=None, mask=None, size=10, min_prominence=1.0, min_distance=None):
+    values = smoothed if values is None else values
+    min_distance = size if min_distance is None else min_distance
+    valid = np.isfinite(smoothed) & np.isfinite(values)
+    if mask is not None:
+        valid &= mask
+    local_min = ndimage.minimum_filter(smoothed, size, mode="nearest")
+    local_max = ndimage.maximum_filter(smoothed, size, mode="nearest")
+    lows = pick_centers("L", valid & (smoothed == local_min), smoothed, values,
+                        local_max - smoothed, min_prominence, min_distance)
+    highs = pick_centers("H", valid & (smoothed == local_max), smoothed, values,
+                         smoothed - local_min, min_prominence, min_distance)
+    return highs + lows
+
+
+# Function to label the centers on a map, x and y being the map coordinates of the grid
+def draw_centers(ax, x, y, centers, show_values=True, fontsize=14):
+    texts = []
+    for center in centers:
+        label = f"{center.kind}\n{center.value:.0f}" if show_values else center.kind
+        texts.append(ax.text(x[center.row, center.col], y[center.row, center.col], label,
+                             color=COLORS[center.kind], fontsize=fontsize, fontweight='bold',
+                             ha='center', va='center'))
+    return texts
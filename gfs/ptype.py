@@ -0,0 +1,56 @@
+import numpy as np
+
+# Precipitation type of a grid cell, as stored in the uint8 category grid
+NONE, RAIN, SNOW, SLEET, FREEZING_RAIN = range(5)
+NAMES = {NONE: "None", RAIN: "Rain", SNOW: "Snow", SLEET: "Sleet", FREEZING_RAIN: "Freezing Rain"}
+
+# 32°F in Kelvin: below it precipitation is snow when only the 2 m temperature is known
+FREEZING_K = 273.15
+
+# Category grids, reflectivity grids and scratch masks already allocated in this process, by grid shape.
+# Every frame of a product has the same shape, so each worker allocates them once.
+_buffers = {}
+
+
+# Function to get the output buffers for a grid shape: (category uint8, reflectivity float32, mask bool)
+def buffers(shape):
+    shape = tuple(shape)
+    if shape not in _buffers:
+        _buffers[shape] = (np.empty(shape, dtype=np.uint8), np.empty(shape, dtype=np.float32),
+                           np.empty(shape, dtype=bool))
+    return _buffers[shape]
+
+
+# Function to classify the precipitation type of every cell in one vectorized pass, writing into
+# preallocated buffers. t2m is the 2 m temperature in Kelvin and refc the composite reflectivity in dBZ.
+# crain, csnow, cicep and cfrzr are the optional GFS categorical fields (1 where that type falls);
+# where any of them is set the dominant one wins (freezing rain, then sleet, then snow, then rain),
+# elsewhere the 32°F threshold on t2m decides between snow and rain.
+# Returns (category, reflectivity), views of the buffers that stay valid until the next call.
+def classify(t2m, refc, crain=None, csnow=None, cicep=None, cfrzr=None):
+    category, reflectivity, mask = buffers(np.shape(t2m))
+    np.copyto(reflectivity, refc, casting="unsafe")
+
+    np.less(t2m, FREEZING_K, out=mask)
+    np.copyto(category, RAIN)
+    np.copyto(category, SNOW, where=mask)
+    # Lowest priority first, so the dominant type is written last
+    for kind, field in ((RAIN, crain), (SNOW, csnow), (SLEET, cicep), (FREEZING_RAIN, cfrzr)):
+        if field is not None:
+            np.greater(field, 0.5, out=mask)
+            np.copyto(category, kind, where=mask)
+
+    # No precipitation type without an echo (NaN reflectivity compares false)
+    np.isfinite(reflectivity, out=mask)
+    np.logical_not(mask, out=mask)
+    np.copyto(category, NONE, where=mask)
+    return category, reflectivity
+
+
+# Function to get the reflectivity of one category with every other cell set to NaN (which contourf
+# leaves blank), written into out or into a new float32 array
+def layer(category, reflectivity, kind, out=None):
+    out = np.empty(reflectivity.shape, dtype=np.float32) if out is None else out
+    out.fill(np.nan)
+    np.copyto(out, reflectivity, where=category == kind)
+    return out
@@ -0,0 +1,99 @@
+from collections import namedtuple
+
+import numpy as np
+from PIL import Image
+
+from gfs import basemaps, render
+
+# Fast render mode (gfs.render.RENDER_MODE "fast"): instead of contourf polygons, every grid cell gets
+# the palette index of its level bin, the frame's pixels pick their nearest cell through an index map
+# cached per grid and map (gfs.basemaps.pixel_index), and the image is written straight away under the
+# cached geography. Colors are those of the contourf colormaps, so both modes look alike.
+# Frames are saved palette-indexed in one fixed palette per product, ready to be animated (gfs.animation).
+
+# Colors of a frame: colors[0] is the background, then one run of colors per layer.
+# layers holds (levels, offset) for each layer: its level boundaries and where its colors start.
+# image is the PIL palette image the finished frames are stored in (see frame_palette).
+Palette = namedtuple("Palette", ["colors", "layers", "image"])
+
+# White background of the frames, as matplotlib draws them
+BACKGROUND = (255, 255, 255, 255)
+
+# How dark the antialiased edges of the black geography lines make the colors under them
+LINE_SHADES = (0.25, 0.5, 0.75)
+
+
+# Function to get the uint8 RGBA colors contourf gives the bins between levels with a BoundaryNorm colormap
+def level_colors(levels, cmap, norm):
+    levels = np.asarray(levels, dtype=float)
+    return np.rint(np.asarray(cmap(norm((levels[:-1] + levels[1:]) / 2))) * 255).astype(np.uint8)
+
+
+# Function to get the fixed palette image frames are stored in: the layer colors, each also shaded
+# by the geography lines drawn over it, and a gray ramp for the lines themselves (255 colors at most,
+# so animations keep one index free for transparency)
+def frame_palette(colors):
+    rgb = colors[:, :3].astype(float)
+    grays = np.repeat(np.linspace(0, 255, 32)[:, None], 3, axis=1)
+    entries = np.unique(np.rint(np.concatenate([rgb, *[rgb * (1 - shade) for shade in LINE_SHADES], grays])),
+                        axis=0).astype(np.uint8)
+    if len(entries) > 255:
+        raise ValueError(f"A frame palette holds at most 255 colors, these layers need {len(entries)}")
+    image = Image.new("P", (1, 1))
+    image.putpalette(entries.tobytes())
+    return image
+
+
+# Function to build the palette of a product from its layers, each (levels, cmap, norm) as given to contourf
+def make_palette(*layers, background=BACKGROUND):
+    colors = [np.array([background], dtype=np.uint8)]
+    entries = []
+    offset = 1
+    for levels, cmap, norm in layers:
+        entries.append((np.asarray(levels, dtype=np.float32), offset))
+        colors.append(level_colors(levels, cmap, norm))
+        offset += len(levels) - 1
+    if offset > 256:
+        raise ValueError(f"A palette holds at most 256 colors, these layers need {offset}")
+    colors = np.concatenate(colors)
+    return Palette(colors, entries, frame_palette(colors))
+
+
+# Function to get the palette options of gfs.animation.Animations for the frames of a product: fast
+# frames are drawn in the product palette itself, quality frames (contourf, legends, colorbars, text)
+# get one of their own colors that also holds the product's, the ones the first frames may not show
+def animation_palette(palette):
+    if render.RENDER_MODE == "fast":
+        return {"palette": palette.image}
+    return {"colors": palette.colors}
+
+
+# Function to write into index (uint8, shaped like values) the palette index of the values of one layer,
+# only where where (optional) is true. Values outside the layer's levels or NaN are left as they were.
+def color_index(palette, layer, values, index, where=None):
+    levels, offset = palette.layers[layer]
+    bins = np.searchsorted(levels, values, side="right")
+    inside = (bins > 0) & (bins < len(levels))
+    if where is not None:
+        inside &= where
+    bins += offset - 1
+    np.copyto(index, bins, where=inside, casting="unsafe")
+    return index
+
+
+# Function to save a frame of palette indexes on a lat/lon grid as an image of a map, with the map's
+# cached geography laid on top, in the palette's frame palette. base_layer is the (name, lines, width, dpi)
+# tuple of the product.
+def save_frame(path, palette, index, lats, lons, base_layer):
+    name = base_layer[0]
+    base = basemaps.base_layer(*base_layer)
+    pixels = basemaps.pixel_index(basemaps.get_basemap(name), name, lats, lons, base.shape[1], base.shape[0])
+    # Pixels the grid does not reach read the extra 0 at the end: the background. Colors are looked
+    # up as one uint32 per pixel, a single gather instead of one per channel.
+    cells = np.append(np.ravel(index), np.uint8(0))
+    colors = np.ascontiguousarray(palette.colors).view(np.uint32)[:, 0]
+    rgba = np.take(colors, np.take(cells, pixels)).view(np.uint8).reshape(*pixels.shape, 4)
+    image = Image.fromarray(rgba, "RGBA")
+    image.alpha_composite(Image.fromarray(base, "RGBA"))
+    image.convert("RGB").quantize(palette=palette.image, dither=Image.Dither.NONE).save(path, compress_level=1)
+    return path
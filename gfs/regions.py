@@ -0,0 +1,74 @@
+from collections import namedtuple
+from functools import lru_cache
+
+import numpy as np
+
+# Map areas drawn by the product scripts, as Basemap arguments (without the coastline resolution).
+# The lat/lon box each one needs is worked out from the map itself, so the two never disagree.
+MAPS = {
+    "conus": dict(projection='cyl', llcrnrlat=20, urcrnrlat=50, llcrnrlon=-130, urcrnrlon=-60),
+    "usa": dict(projection='lcc', lat_0=37.5, lon_0=-98.35, width=6e6, height=3e6),
+    "northeast": dict(projection='lcc', lat_0=41.5, lon_0=-74, width=2.5e6, height=1.5e6),
+    "north_america": dict(projection='lcc', lat_0=37.5, lon_0=-98.35, width=9e6, height=6e6),
+}
+
+# Extra degrees kept around a map so contours reach its edges
+MARGIN = 2
+
+# Function to get how many grid cells beyond its own a chain of filters reads: a gaussian_filter of
+# sigma (cut at truncate sigmas, as SciPy does) followed by a size-wide window filter over its output,
+# so the radius of the two added up. Keeping that many cells around a map makes the filtered values
+# inside it the same as on the whole globe.
+def filter_halo(sigma=0, size=0, truncate=4.0):
+    return int(truncate * sigma + 0.5) + size // 2
+
+
+# A lat/lon box with longitudes in -180..180 (west may be greater than east across the dateline)
+Region = namedtuple("Region", ["south", "north", "west", "east"])
+
+
+# Function to get the lat/lon box covering a map from MAPS, padded by margin degrees
+# and rounded out to whole degrees
+@lru_cache(maxsize=None)
+def map_region(name, margin=MARGIN):
+    from mpl_toolkits.basemap import Basemap
+
+    m = Basemap(resolution=None, **MAPS[name])
+    # Walk the edges of the map, the box of a conic map is widest along its curved edges
+    s = np.linspace(0, 1, 201)
+    x = m.llcrnrx + (m.urcrnrx - m.llcrnrx) * np.concatenate([s, np.ones_like(s), s, np.zeros_like(s)])
+    y = m.llcrnry + (m.urcrnry - m.llcrnry) * np.concatenate([np.zeros_like(s), s, np.ones_like(s), s])
+    lons, lats = m(x, y, inverse=True)
+    lons = (np.asarray(lons) + 180) % 360 - 180
+    return Region(max(-90, int(np.floor(lats.min() - margin))), min(90, int(np.ceil(lats.max() + margin))),
+                  int(np.floor(lons.min() - margin)), int(np.ceil(lons.max() + margin)))
+
+
+# Function to get the smallest box holding all the given regions (none of them crossing the dateline)
+def union(regions):
+    regions = list(regions)
+    return Region(min(r.south for r in regions), max(r.north for r in regions),
+                  min(r.west for r in regions), max(r.east for r in regions))
+
+
+# Function to build the NOMADS filter parameters that cut a file down to a region
+def subregion_params(region):
+    return (f"&subregion=&leftlon={region.west}&rightlon={region.east}"
+            f"&toplat={region.north}&bottomlat={region.south}")
+
+
+# Function to cut an xarray Dataset on a regular lat/lon grid down to a region.
+# Works for 0..360 and -180..180 longitudes and for either latitude order; nothing is read yet.
+def crop(dataset, region):
+    lats = dataset["latitude"].values
+    lons = dataset["longitude"].values
+    lat_index = np.nonzero((lats >= region.south) & (lats <= region.north))[0]
+    west, east = region.west, region.east
+    if lons.max() > 180:
+        west, east = west % 360, east % 360
+    if west <= east:
+        lon_index = np.nonzero((lons >= west) & (lons <= east))[0]
+    else:
+        # The region wraps around the end of the longitude axis
+        lon_index = np.concatenate([np.nonzero(lons >= west)[0], np.nonzero(lons <= east)[0]])
+    return dataset.isel(latitude=lat_index, longitude=lon_index)
@@ -0,0 +1,37 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+# Number of processes frames are drawn in, one frame per process at a time.
+# It can be overridden with the GFS_RENDER_WORKERS variable (1 draws in this process).
+RENDER_WORKERS = int(os.environ.get("GFS_RENDER_WORKERS", str(os.cpu_count() or 1)))
+
+# How the products draw their frames: "quality" with matplotlib contourf, colorbars and titles,
+# "fast" straight to pixels through a palette (gfs.raster). Set with the GFS_RENDER_MODE variable.
+RENDER_MODE = os.environ.get("GFS_RENDER_MODE", "quality")
+
+
+# Function run once in every worker: draw off-screen, workers have no display
+def init_worker():
+    import matplotlib
+    matplotlib.use("Agg")
+
+
+# Function to draw frames in parallel. function is called once per tuple of arguments in tasks;
+# it must be defined at module level (so the workers can import it) and create and close its own
+# figure. Yields the results in the order of tasks as soon as each one and those before it are done,
+# so the frames can be animated while the later ones are still being drawn.
+def iter_frames(function, tasks, workers=RENDER_WORKERS):
+    tasks = list(tasks)
+    workers = max(1, min(workers, len(tasks)))
+    if workers == 1:
+        init_worker()
+        for task in tasks:
+            yield function(*task)
+        return
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+        yield from executor.map(function, *zip(*tasks))
+
+
+# Function to draw frames in parallel like iter_frames, returning the results in the order of tasks
+def render_frames(function, tasks, workers=RENDER_WORKERS):
+    return list(iter_frames(function, tasks, workers))
@@ -0,0 +1,115 @@
+import argparse
+import os
+import posixpath
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+from gfs import grib_idx
+
+# Local stand-in for the NOMADS data directory, used to try the byte-range backend offline.
+# A request for .../gfs.t12z.pgrb2.0p25.f006 is answered with the matching .grib2 files from
+# every folder given on the command line joined together, and .../gfs.t12z.pgrb2.0p25.f006.idx
+# with a wgrib2 style inventory of that file. Range and multi-range requests are supported.
+#
+#   python -m gfs.standin public/grib/temp public/grib/refc public/mslet --port 8000
+#   GFS_BACKEND=idx GFS_DATA_URL=http://127.0.0.1:8000 python rainsnow/USARAINSNOW.py
+
+BOUNDARY = "GRIBSTANDIN"
+
+
+# Function to join the sample files for one GRIB name, returns None if there are none
+def load_grib(folders, name):
+    data = b""
+    for folder in folders:
+        # public/mslet names its samples like gfs_t12z_pgrb2_1p00_f006.grb2
+        for filename in [name, name + ".grib2", name + ".grb2", name.replace(".", "_") + ".grb2"]:
+            path = os.path.join(folder, filename)
+            if os.path.isfile(path):
+                with open(path, 'rb') as file:
+                    data += file.read()
+                break
+    return data or None
+
+
+# Function to parse a Range header into (start, end) pairs with inclusive ends
+def parse_range(header, size):
+    ranges = []
+    for part in header.replace("bytes=", "").split(","):
+        start, end = part.strip().split("-")
+        if start == "":
+            start, end = size - int(end), size - 1
+        else:
+            start, end = int(start), min(int(end), size - 1) if end else size - 1
+        ranges.append((start, end))
+    return ranges
+
+
+def make_handler(folders):
+    class StandinHandler(BaseHTTPRequestHandler):
+        def do_HEAD(self):
+            self.respond(send_body=False)
+
+        def do_GET(self):
+            self.respond(send_body=True)
+
+        def respond(self, send_body):
+            name = posixpath.basename(urlparse(self.path).path)
+            if name.endswith(".idx"):
+                data = load_grib(folders, name[:-4])
+                if data is not None:
+                    data = grib_idx.make_inventory(data).encode()
+            else:
+                data = load_grib(folders, name)
+            if data is None:
+                self.send_error(404)
+                return
+
+            header = self.headers.get("Range")
+            if not header:
+                self.send_body(200, data, "application/octet-stream", send_body)
+                return
+            ranges = parse_range(header, len(data))
+            if any(start >= len(data) for start, _ in ranges):
+                # Nothing left to send from there, as a partial file that is already complete asks for
+                self.send_body(416, b"", "application/octet-stream", send_body,
+                               {"Content-Range": f"bytes */{len(data)}"})
+                return
+            if len(ranges) == 1:
+                start, end = ranges[0]
+                self.send_body(206, data[start:end + 1], "application/octet-stream", send_body,
+                               {"Content-Range": f"bytes {start}-{end}/{len(data)}"})
+                return
+            body = b""
+            for start, end in ranges:
+                body += (f"--{BOUNDARY}\r\nContent-Type: application/octet-stream\r\n"
+                         f"Content-Range: bytes {start}-{end}/{len(data)}\r\n\r\n").encode()
+                body += data[start:end + 1] + b"\r\n"
+            body += f"--{BOUNDARY}--\r\n".encode()
+            self.send_body(206, body, f"multipart/byteranges; boundary={BOUNDARY}", send_body)
+
+        def send_body(self, status, body, content_type, send_body, headers=None):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("Accept-Ranges", "bytes")
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            if send_body:
+                self.wfile.write(body)
+
+    return StandinHandler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve local GRIB files like the NOMADS data directory")
+    parser.add_argument("folders", nargs="+", help="folders with .grib2 files to serve")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(args.folders))
+    print(f"Serving {', '.join(args.folders)} on http://127.0.0.1:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import unittest
+from http.server import ThreadingHTTPServer
+
+from gfs import download, grib_idx, standin
+from gfs.manifest import file_checksum, partial_path
+
+# Tests of the downloader against the local NOMADS stand-in (gfs.standin), run with
+#   python -m unittest discover -s . -p "*test*.py"
+# The stand-in serves a GRIB file made of small synthetic GRIB2 messages: only the sections the
+# inventory reads (1 and 4) and some padding, which is all the downloader looks at.
+
+GRIB_NAME = "gfs.t12z.pgrb2.0p25.f006"
+
+
+# Function to build one GRIB2 message of a parameter (category, number) at a fixed surface.
+# With average set, the product is an average over the last 6 hours (template 4.8) like the
+# "0-6 hour ave fcst" messages GFS writes next to the instant ones.
+def grib_message(category, number, surface_type, value, padding, forecast_time=6, average=False):
+    section1 = struct.pack(">IB7xHBBB4x", 21, 1, 2025, 3, 2, 12)
+    template = 8 if average else 0
+    section4 = struct.pack(">IBHHBB7xIBbI6x", 58 if average else 34, 4, 0, template, category, number,
+                           forecast_time - 6 if average else forecast_time, surface_type, 0, value)
+    if average:
+        section4 += struct.pack(">HBBBBBBIBBBIBI", 2025, 3, 2, 18, 0, 0, 1, 0, 0, 2, 1, 6, 1, 0)
+    section7 = struct.pack(">IB", 5 + padding, 7) + bytes(range(256)) * (padding // 256) + bytes(padding % 256)
+    body = section1 + section4 + section7
+    return b"GRIB" + struct.pack(">2xBBQ", 0, 2, 16 + len(body) + 4) + body + b"7777"
+
+
+# The messages of the served file, by name
+MESSAGES = {
+    "TMP": grib_message(0, 0, 103, 2, 3000),
+    "REFC": grib_message(16, 196, 10, 0, 5000),
+    "CRAIN": grib_message(1, 192, 1, 0, 700),
+    "CRAIN_AVE": grib_message(1, 192, 1, 0, 700, average=True),
+    "PRMSL": grib_message(3, 1, 101, 0, 2000),
+}
+
+
+class StandinDownloadTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.folder = tempfile.mkdtemp()
+        cls.data = b"".join(MESSAGES.values())
+        with open(os.path.join(cls.folder, GRIB_NAME + ".grib2"), 'wb') as file:
+            file.write(cls.data)
+        # Port 0 lets the system pick a free port
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), standin.make_handler([cls.folder]))
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.url = f"http://127.0.0.1:{cls.server.server_address[1]}/{GRIB_NAME}"
+        cls.session = download.make_session()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        cls.session.close()
+        shutil.rmtree(cls.folder)
+
+    def setUp(self):
+        self.output = tempfile.mkdtemp()
+        self.filename = os.path.join(self.output, "step.grib2")
+
+    def tearDown(self):
+        shutil.rmtree(self.output)
+
+    def step_request(self, fields):
+        return download.StepRequest("2025030212", "f006", tuple(fields), self.url, "idx")
+
+    def read(self, path):
+        with open(path, 'rb') as file:
+            return file.read()
+
+    def test_full_fetch(self):
+        checksum = download.fetch(self.session, self.url, self.filename)
+        self.assertEqual(self.read(self.filename), self.data)
+        self.assertEqual(checksum, file_checksum(self.filename))
+        self.assertFalse(os.path.exists(partial_path(self.filename)))
+
+    def test_resumed_fetch(self):
+        with open(partial_path(self.filename), 'wb') as file:
+            file.write(self.data[:4000])
+        checksum = download.fetch(self.session, self.url, self.filename)
+        self.assertEqual(self.read(self.filename), self.data)
+        self.assertEqual(checksum, file_checksum(self.filename))
+
+    def test_complete_partial_file(self):
+        # The server answers 416 to a range starting at the end, the partial file is already whole
+        with open(partial_path(self.filename), 'wb') as file:
+            file.write(self.data)
+        checksum = download.fetch(self.session, self.url, self.filename)
+        self.assertEqual(self.read(self.filename), self.data)
+        self.assertEqual(checksum, file_checksum(self.filename))
+
+    def test_inventory(self):
+        entries = grib_idx.parse_inventory(grib_idx.make_inventory(self.data))
+        self.assertEqual([(entry.variable, entry.level, entry.forecast) for entry in entries], [
+            ("TMP", "2 m above ground", "6 hour fcst"),
+            ("REFC", "entire atmosphere", "6 hour fcst"),
+            ("CRAIN", "surface", "6 hour fcst"),
+            ("CRAIN", "surface", "0-6 hour ave fcst"),
+            ("PRMSL", "mean sea level", "6 hour fcst"),
+        ])
+
+    def test_coalesce_ranges(self):
+        self.assertEqual(grib_idx.coalesce_ranges([(10, 19), (0, 9), (30, 39), (35, None)]), [(0, 19), (30, None)])
+
+    def test_multipart_idx_fetch(self):
+        # TMP and PRMSL are apart in the file, so both come back in one multipart/byteranges answer
+        request = self.step_request([download.TMP_2M, download.PRMSL])
+        checksum = download.fetch(self.session, request, self.filename)
+        self.assertEqual(self.read(self.filename), MESSAGES["TMP"] + MESSAGES["PRMSL"])
+        self.assertEqual(checksum, file_checksum(self.filename))
+        self.assertTrue(grib_idx.check_grib(self.filename))
+
+    def test_instant_idx_fetch(self):
+        # Only the instant precipitation type is fetched, not its average over the period
+        request = self.step_request([download.CRAIN])
+        download.fetch(self.session, request, self.filename)
+        self.assertEqual(self.read(self.filename), MESSAGES["CRAIN"])
+
+    def test_resumed_idx_fetch(self):
+        request = self.step_request([download.TMP_2M, download.REFC, download.PRMSL])
+        expected = MESSAGES["TMP"] + MESSAGES["REFC"] + MESSAGES["PRMSL"]
+        # Interrupted in the middle of the REFC message
+        with open(partial_path(self.filename, request.run), 'wb') as file:
+            file.write(expected[:len(MESSAGES["TMP"]) + 1000])
+        checksum = download.fetch(self.session, request, self.filename)
+        self.assertEqual(self.read(self.filename), expected)
+        self.assertEqual(checksum, file_checksum(self.filename))
+
+    def test_missing_file(self):
+        self.assertIsNone(download.fetch(self.session, self.url + "x", self.filename))
+        self.assertFalse(os.path.exists(self.filename))
+
+
+if __name__ == '__main__':
+    unittest.main()
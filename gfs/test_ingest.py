@@ -0,0 +1,44 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from gfs import download, ingest
+
+# Tests of the ingest stage around the network, run with
+#   python -m unittest discover -s . -p "*test*.py"
+
+
+class IngestLockTest(unittest.TestCase):
+    def setUp(self):
+        # ingest works in paths relative to the repository, so run it in an empty folder
+        self.cwd = os.getcwd()
+        self.folder = tempfile.mkdtemp()
+        os.chdir(self.folder)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.folder)
+
+    def test_lock_survives_prune(self):
+        # A file of an older run, which the manifest prunes before the download starts
+        os.makedirs(ingest.GRIB_CACHE_FOLDER)
+        stale = ingest.grib_path("06", "f000")
+        open(stale, 'w').close()
+
+        lock_present = []
+
+        def download_groups(groups, manifest=None):
+            lock_present.append(os.path.exists(ingest.LOCK_PATH))
+
+        with mock.patch.object(download, "find_run", return_value=("20250302", "12")), \
+                mock.patch.object(download, "download_groups", download_groups):
+            self.assertEqual(ingest.ingest(["f000"]), ("20250302", "12"))
+        self.assertFalse(os.path.exists(stale))
+        self.assertEqual(lock_present, [True])
+        self.assertTrue(os.path.exists(ingest.LOCK_PATH))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+import io
+import math
+import os
+import re
+import sqlite3
+
+import numpy as np
+from PIL import Image
+
+# Web Mercator XYZ tiles of the rendered fields, so map clients only fetch the part they view.
+# Each product and step gets its own MBTiles file (SQLite, rows in TMS order as the spec wants):
+# TILE_FOLDER/<product>/<step>.mbtiles, rebuilt from the palette indexes the renderers already
+# computed (gfs.raster) and read by the /tiles route of app.py.
+TILE_FOLDER = os.path.join("public", "tiles")
+
+# Zoom levels written, from the whole country to about 2 km per pixel (the 0.25° grid is ~25 km)
+ZOOMS = (3, 4, 5, 6)
+
+TILE_SIZE = 256
+
+# Web Mercator does not reach the poles
+MAX_LATITUDE = 85.0511
+
+# Product and step names are used as path parts, so only plain names are accepted
+NAME = re.compile(r"^[A-Za-z0-9_]+$")
+
+
+# Function to get the MBTiles file of one step of a product, None for names that are not plain
+def tile_path(product, step):
+    if not (NAME.match(product) and NAME.match(step)):
+        return None
+    return os.path.join(TILE_FOLDER, product, f"{step}.mbtiles")
+
+
+# Function to get the range of tile columns and rows (x, y) covering a lat/lon box at a zoom level
+def tile_range(region, zoom):
+    count = 2 ** zoom
+
+    def tile_x(lon):
+        return min(count - 1, max(0, int((lon + 180) / 360 * count)))
+
+    def tile_y(lat):
+        lat = math.radians(max(-MAX_LATITUDE, min(MAX_LATITUDE, lat)))
+        return min(count - 1, max(0, int((1 - math.asinh(math.tan(lat)) / math.pi) / 2 * count)))
+
+    return range(tile_x(region.west), tile_x(region.east) + 1), range(tile_y(region.north), tile_y(region.south) + 1)
+
+
+# Function to get the longitudes of the pixel columns and the latitudes of the pixel rows of a tile.
+# In Web Mercator both only depend on one axis, so a tile is a plain outer product of two lookups.
+def tile_coordinates(zoom, x, y):
+    pixels = (np.arange(TILE_SIZE) + 0.5) / TILE_SIZE
+    count = 2 ** zoom
+    lons = (x + pixels) / count * 360 - 180
+    lats = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * (y + pixels) / count))))
+    return lons, lats
+
+
+# Function to get the index of the nearest point of a regular axis for each coordinate, -1 outside it
+def nearest(axis, values):
+    index = np.rint((values - axis[0]) / (axis[1] - axis[0])).astype(np.int64)
+    return np.where((index >= 0) & (index < len(axis)), index, -1)
+
+
+# Function to write the tiles of one step of a product from a grid of palette indexes (uint8, 0 is
+# no data) on a regular lat/lon grid, covering region at every zoom of zooms. palette is the
+# gfs.raster.Palette the indexes refer to. Tiles with no data are left out.
+def write_tiles(product, step, run, palette, index, lats, lons, region, zooms=ZOOMS):
+    path = tile_path(product, step)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+
+    colors = np.asarray(palette.colors)[:, :3].tobytes()
+    # Pixels the grid does not reach read the extra 0 at the end: no data
+    cells = np.append(np.ravel(index), np.uint8(0)).astype(np.uint8)
+    width = len(lons)
+    connection = sqlite3.connect(temp_path)
+    try:
+        connection.execute("CREATE TABLE metadata (name TEXT, value TEXT)")
+        connection.execute("CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, "
+                           "tile_data BLOB)")
+        connection.executemany("INSERT INTO metadata VALUES (?, ?)", [
+            ("name", f"{product} {step}"), ("format", "png"), ("type", "overlay"), ("version", run),
+            ("minzoom", str(min(zooms))), ("maxzoom", str(max(zooms))),
+            ("bounds", f"{region.west},{region.south},{region.east},{region.north}"),
+        ])
+        for zoom in zooms:
+            columns, rows = tile_range(region, zoom)
+            for x in columns:
+                for y in rows:
+                    tile_lons, tile_lats = tile_coordinates(zoom, x, y)
+                    row, col = nearest(lats, tile_lats), nearest(lons, tile_lons)
+                    flat = np.where((row[:, None] >= 0) & (col[None, :] >= 0), row[:, None] * width + col[None, :], -1)
+                    pixels = cells[flat]
+                    if not pixels.any():
+                        continue
+                    image = Image.fromarray(pixels, "P")
+                    image.putpalette(colors)
+                    data = io.BytesIO()
+                    image.save(data, format="PNG", transparency=0)
+                    # MBTiles rows count from the south
+                    connection.execute("INSERT INTO tiles VALUES (?, ?, ?, ?)",
+                                       (zoom, x, 2 ** zoom - 1 - y, data.getvalue()))
+        connection.execute("CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column, tile_row)")
+        connection.commit()
+    finally:
+        connection.close()
+    os.replace(temp_path, path)
+    return path
+
+
+# Function to read one XYZ tile, returns the PNG bytes or None if there is no such tile
+def read_tile(product, step, zoom, x, y):
+    path = tile_path(product, step)
+    if path is None or not os.path.exists(path):
+        return None
+    connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        row = connection.execute("SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? "
+                                 "AND tile_row = ?", (zoom, x, 2 ** zoom - 1 - y)).fetchone()
+    finally:
+        connection.close()
+    return None if row is None else row[0]
+
+
+# Function to delete the tiles of every step of a product that is not in steps
+def prune(product, steps):
+    folder = os.path.join(TILE_FOLDER, product)
+    if not os.path.isdir(folder):
+        return
+    keep = {f"{step}.mbtiles" for step in steps}
+    for name in os.listdir(folder):
+        if name not in keep:
+            os.remove(os.path.join(folder, name))
+
+
+# A fully transparent tile, for the parts of the map without data
+_empty = io.BytesIO()
+Image.new("P", (TILE_SIZE, TILE_SIZE)).save(_empty, format="PNG", transparency=0)
+EMPTY_TILE = _empty.getvalue()
@@ -0,0 +1,103 @@
+import json
+import os
+from collections import namedtuple
+
+import numpy as np
+
+# Pressure centers linked across forecast steps, stored as columns with one row per center per step,
+# sorted by track then step. deepening is the fall of the central pressure since the previous point
+# of the track in hPa per hour (negative when it rises), NaN at the first point.
+Tracks = namedtuple("Tracks", ["track", "kind", "step", "hour", "lat", "lon", "pressure", "deepening"])
+
+EARTH_RADIUS_KM = 6371.0
+
+# Fastest a center is expected to move, in km per hour; a center further than this from where a
+# track was last seen starts a new track
+MAX_SPEED = 100
+
+
+# Function to get great circle distances in km between points given in degrees (broadcasts)
+def haversine(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+# Function to turn gfs.pressure centers found on a grid into (kind, lat, lon, pressure) tuples
+def locate(centers, lats, lons):
+    return [(center.kind, float(lats[center.row]), float(lons[center.col]), center.value) for center in centers]
+
+
+# Function to link the centers of consecutive steps into tracks. centers_by_step holds one list of
+# (kind, lat, lon, pressure) per step, None or empty for steps without data, which are skipped.
+# Centers are matched to the track ends of the last step with centers of the same kind, nearest
+# pairs first, as long as they moved less than max_speed allows since the hour each track was last seen.
+def link_centers(steps, centers_by_step, max_speed=MAX_SPEED):
+    hours = [int(step.lstrip("f")) for step in steps]
+    rows = []
+    previous = []  # (track, kind, lat, lon, pressure, hour) of the centers of the last step with centers
+    next_track = 0
+    for i, centers in enumerate(centers_by_step):
+        if not centers:
+            continue
+        tracks = [None] * len(centers)
+        if previous:
+            kinds = np.array([center[0] for center in centers])
+            lats = np.array([center[1] for center in centers])
+            lons = np.array([center[2] for center in centers])
+            distance = haversine(np.array([p[2] for p in previous])[:, None], np.array([p[3] for p in previous])[:, None],
+                                 lats[None, :], lons[None, :])
+            allowed = (np.array([p[1] for p in previous])[:, None] == kinds[None, :])
+            allowed &= distance <= max_speed * (hours[i] - np.array([p[5] for p in previous]))[:, None]
+            distance = np.where(allowed, distance, np.inf)
+            used = set()
+            for flat in np.argsort(distance, axis=None):
+                a, b = divmod(int(flat), distance.shape[1])
+                if not np.isfinite(distance[a, b]):
+                    break
+                if a in used or tracks[b] is not None:
+                    continue
+                used.add(a)
+                tracks[b] = previous[a]
+        current = []
+        for b, (kind, lat, lon, value) in enumerate(centers):
+            if tracks[b] is None:
+                track, deepening = next_track, np.nan
+                next_track += 1
+            else:
+                track = tracks[b][0]
+                deepening = (tracks[b][4] - value) / (hours[i] - tracks[b][5])
+            rows.append((track, kind, steps[i], hours[i], lat, lon, value, deepening))
+            current.append((track, kind, lat, lon, value, hours[i]))
+        previous = current
+
+    rows.sort(key=lambda row: (row[0], row[3]))
+    columns = list(zip(*rows)) or [[]] * len(Tracks._fields)
+    dtypes = [np.int32, "U1", "U4", np.int32, np.float32, np.float32, np.float32, np.float32]
+    return Tracks(*(np.array(column, dtype=dtype) for column, dtype in zip(columns, dtypes)))
+
+
+# Function to write the tracks with at least min_points points as JSON for the web app
+def export_json(tracks, path, run, min_points=2):
+    output = []
+    for track in np.unique(tracks.track):
+        rows = np.nonzero(tracks.track == track)[0]
+        if len(rows) < min_points:
+            continue
+        output.append({
+            "id": int(track),
+            "kind": str(tracks.kind[rows[0]]),
+            "points": [{
+                "step": str(tracks.step[row]),
+                "hour": int(tracks.hour[row]),
+                "lat": round(float(tracks.lat[row]), 2),
+                "lon": round(float(tracks.lon[row]), 2),
+                "pressure": round(float(tracks.pressure[row]), 1),
+                "deepening": None if np.isnan(tracks.deepening[row]) else round(float(tracks.deepening[row]), 2),
+            } for row in rows],
+        })
+    temp_path = path + ".tmp"
+    with open(temp_path, 'w') as file:
+        json.dump({"run": run, "tracks": output}, file)
+    os.replace(temp_path, path)
+    return path
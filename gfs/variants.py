@@ -0,0 +1,114 @@
+import importlib
+import os
+
+from PIL import Image
+
+from gfs import manifest
+
+# Smaller copies of the still frames, in their own format and in WebP and AVIF, written when a
+# product is published (gfs.catalog.publish). The web app sends the one that fits the width the page
+# asks for (srcset) and the formats the browser accepts (Accept header).
+# Layout: <gallery folder>/VARIANT_FOLDER/<frame name>.<width>.<extension>
+VARIANT_FOLDER = "variants"
+
+# Frames that get variants, animations keep their own WebP/MP4 versions (gfs.animation)
+STILL_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+# Widths written below the frame's own, in pixels
+WIDTHS = (640, 1280)
+
+# AVIF needs a Pillow built with it (recent releases) or the pillow-avif-plugin package, it is left out otherwise.
+# The plugin is imported only for the AVIF support it registers with Pillow.
+try:
+    importlib.import_module("pillow_avif")
+except ImportError:
+    pass
+Image.init()
+
+# Compact encodings written at every width, by MIME type.
+# Resized frames are antialiased and encode best lossy; frames drawn in a palette (gfs.raster)
+# are flat colors and keep their full size lossless (about a third of the PNG).
+ENCODINGS = {
+    mimetype: encoding for mimetype, encoding in {
+        "image/avif": ("avif", {"format": "AVIF", "quality": 60, "speed": 8}),
+        "image/webp": ("webp", {"format": "WEBP", "quality": 80, "method": 4}),
+    }.items() if encoding[1]["format"] in Image.SAVE
+}
+
+# Own formats of the frames, for browsers that accept none of the ENCODINGS
+MIMETYPES = {".png": "image/png", ".jpg": "image/jpeg", ".jpeg": "image/jpeg"}
+
+
+# Function to get the path of a variant of a frame, relative to its gallery folder
+def variant_name(filename, width, extension):
+    return f"{VARIANT_FOLDER}/{filename}.{width}.{extension}"
+
+
+# Function to save one variant of a frame and get its catalog entry
+def save_variant(folder, name, image, width, mimetype, options):
+    path = os.path.join(folder, *name.split("/"))
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    image.save(temp_path, **options)
+    os.replace(temp_path, path)
+    return {"name": name, "width": width, "type": mimetype, "size": os.path.getsize(path),
+            "sha256": manifest.file_checksum(path)}
+
+
+# Function to write the variants of one frame of a gallery folder.
+# Returns the frame's width and the catalog entries of its variants.
+def write_variants(folder, filename):
+    os.makedirs(os.path.join(folder, VARIANT_FOLDER), exist_ok=True)
+    extension = os.path.splitext(filename)[1].lower()
+    entries = []
+    with Image.open(os.path.join(folder, filename)) as image:
+        image.load()
+    flat = image.mode == "P"
+    rgb = image.convert("RGB")
+    width, height = image.size
+    for variant_width in [w for w in WIDTHS if w < width] + [width]:
+        if variant_width == width:
+            resized = rgb
+        else:
+            resized = rgb.resize((variant_width, round(height * variant_width / width)), Image.LANCZOS)
+            # The frame's own format too, PNGs in a palette like the frames themselves (a quarter of the size)
+            if extension == ".png":
+                own = resized.quantize(256, method=Image.Quantize.FASTOCTREE, dither=Image.Dither.NONE)
+                entries.append(save_variant(folder, variant_name(filename, variant_width, "png"), own,
+                                            variant_width, "image/png", {"format": "PNG"}))
+            else:
+                entries.append(save_variant(folder, variant_name(filename, variant_width, "jpg"), resized,
+                                            variant_width, "image/jpeg", {"format": "JPEG", "quality": 85}))
+        for mimetype, (suffix, options) in ENCODINGS.items():
+            if flat and variant_width == width and mimetype == "image/webp":
+                options = {"format": "WEBP", "lossless": True, "method": 4}
+            entries.append(save_variant(folder, variant_name(filename, variant_width, suffix), resized,
+                                        variant_width, mimetype, options))
+    return width, entries
+
+
+# Function to delete the variants of a gallery folder that are not in keep (names as in the catalog)
+def prune(folder, keep):
+    variant_folder = os.path.join(folder, VARIANT_FOLDER)
+    if not os.path.isdir(variant_folder):
+        return
+    keep = {name.split("/")[-1] for name in keep}
+    for name in os.listdir(variant_folder):
+        if name not in keep:
+            try:
+                os.remove(os.path.join(variant_folder, name))
+            except OSError as e:
+                print(f"Error deleting {name}: {e}")
+
+
+# Function to pick what to send of a frame from its catalog entry: of the variants as wide as the
+# smallest one at least width pixels wide (the frame's own width without width or when none is),
+# the smallest in a MIME type of accepted. Returns the variant entry or None for the frame itself.
+def pick(file, accepted, width=None):
+    candidates = file.get("variants", [])
+    target = file.get("width")
+    if width:
+        wide = [variant["width"] for variant in candidates if variant["width"] >= width]
+        if wide:
+            target = min(wide)
+    candidates = [variant for variant in candidates if variant["width"] == target and variant["type"] in accepted]
+    return min(candidates, key=lambda variant: variant["size"], default=None)
@@ -1,21 +1,16 @@
 import os
-import requests
-import xarray as xr
+import shutil
+import sys
 import numpy as np
 import matplotlib.pyplot as plt
-from mpl_toolkits.basemap import Basemap
-from datetime import datetime, timedelta
-from PIL import Image
 import time
 
-# Folder paths for GRIB data and image outputs
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from gfs import animation, basemaps, catalog, download, ingest, ptype, raster, render, tiles
+
+# Folder path for image outputs, GRIB data is shared through gfs.ingest
 base_folder = "./public"
-grib_folder = os.path.join(base_folder, "grib")  # Folder for GRIB data
-grib_folder_temp = os.path.join(grib_folder, "temp")  # Folder for temperature GRIB files
-grib_folder_refc = os.path.join(grib_folder, "refc")  # Folder for reflectivity GRIB files
 rs_folder = os.path.join(base_folder, "RS", "USA")  # Use "RS/USA" folder for image output
-os.makedirs(grib_folder_temp, exist_ok=True)
-os.makedirs(grib_folder_refc, exist_ok=True)
 os.makedirs(rs_folder, exist_ok=True)  # Ensure the "RS/USA" folder exists
 
 # Function to delete all files in a folder
@@ -26,161 +21,162 @@ def delete_all_files_in_folder(folder_path):
             if os.path.isfile(file_path):
                 os.remove(file_path)  # Remove the file
             elif os.path.isdir(file_path):
-                os.rmdir(file_path)  # Remove the directory
+                shutil.rmtree(file_path)  # Remove the directory and its contents (the frame variants)
         except Exception as e:
             print(f"Error deleting {file_path}: {e}")
 
+# Product of gfs.ingest the fields and map tiles belong to
+product = "rainsnow_usa"
+
+# Cached map and geography every frame is drawn on: map, lines, width in inches and dpi of the saved frames
+map_name = "usa"
+base_layer = (map_name, basemaps.COUNTY_LINES, 10, 150)
+
+# Formats the animation is written in (gfs.animation.FORMATS), the GIF stays for older browsers
+animation_formats = ("gif", "webp", "mp4")
+
+# Define reflectivity bounds and colors for snow and rain with custom levels and colors
+rain_levels = [10, 20, 30, 40, 50, 60, 75]
+rain_colors = ['#b2ff59', '#66bb6a', '#006400', '#ffff00', '#ff8c00', '#ff0000']  # Light green to dark red
+cmap_refc_rain = plt.cm.colors.ListedColormap(rain_colors)
+norm_refc_rain = plt.cm.colors.BoundaryNorm(rain_levels, cmap_refc_rain.N)
+
+snow_levels = [0, 5, 10, 15, 20, 25, 30, 35, 40]  
+snow_colors = ['#e0f7fa', '#b3e5fc', '#81d4fa', '#4fc3f7', '#29b6f6', '#039be5',  
+           '#0288d1', '#0277bd', '#01579b']  # Light to dark blue  
+cmap_refc_snow = plt.cm.colors.ListedColormap(snow_colors)  
+norm_refc_snow = plt.cm.colors.BoundaryNorm(snow_levels, cmap_refc_snow.N)
+
+# Freezing rain and sleet, drawn where the GFS categorical fields call for them
+mixed_levels = [10, 20, 30, 40, 50, 75]
+freezing_rain_colors = ['#ffc0cb', '#ff69b4', '#ff1493', '#c71585', '#8b008b']  # Light pink to dark magenta
+cmap_refc_freezing_rain = plt.cm.colors.ListedColormap(freezing_rain_colors)
+norm_refc_freezing_rain = plt.cm.colors.BoundaryNorm(mixed_levels, cmap_refc_freezing_rain.N)
+sleet_colors = ['#e6ccff', '#c299ff', '#9966ff', '#7a33ff', '#5200cc']  # Light to dark purple
+cmap_refc_sleet = plt.cm.colors.ListedColormap(sleet_colors)
+norm_refc_sleet = plt.cm.colors.BoundaryNorm(mixed_levels, cmap_refc_sleet.N)
+
+# Palette of the fast render mode and the map tiles, one layer per precipitation type
+fast_layers = [ptype.SNOW, ptype.RAIN, ptype.FREEZING_RAIN, ptype.SLEET]
+fast_palette = raster.make_palette((snow_levels, cmap_refc_snow, norm_refc_snow),
+                                   (rain_levels, cmap_refc_rain, norm_refc_rain),
+                                   (mixed_levels, cmap_refc_freezing_rain, norm_refc_freezing_rain),
+                                   (mixed_levels, cmap_refc_sleet, norm_refc_sleet))
+
+# Function to generate a single reflectivity plot for both snow and rain
+# It runs in a worker process of gfs.render, so everything it needs is passed in or defined at module level
+def create_combined_reflectivity_plot(date_str, hour_str, forecast_step, output_filename):
+    try:
+        # Fields decoded once by the ingest stage, already cut to this map
+        temperature = ingest.load_field(date_str + hour_str, forecast_step, download.TMP_2M, product)
+        reflectivity = ingest.load_field(date_str + hour_str, forecast_step, download.REFC, product)
+
+        if temperature is not None:
+            lats = temperature.lats
+            lons = temperature.lons
+
+            if reflectivity is not None:
+                # Precipitation type and reflectivity in one pass, with the categorical fields where they were decoded
+                precip_types = [ingest.load_field(date_str + hour_str, forecast_step, field, product)
+                                for field in download.PRECIP_TYPES]
+                category, refc = ptype.classify(temperature.values, reflectivity.values,
+                                                *[None if field is None else field.values for field in precip_types])
+
+                # Palette indexes of the frame, written as map tiles and drawn directly in the fast mode
+                index = np.zeros(category.shape, dtype=np.uint8)
+                for layer, kind in enumerate(fast_layers):
+                    raster.color_index(fast_palette, layer, refc, index, where=category == kind)
+                tiles.write_tiles(product, forecast_step, date_str + hour_str, fast_palette, index, lats, lons,
+                                  ingest.product_region(product))
+
+                if render.RENDER_MODE == "fast":
+                    # Straight to pixels through the palette, without contour polygons
+                    raster.save_frame(output_filename, fast_palette, index, lats, lons, base_layer)
+                    print(f"Plot saved: {output_filename}")
+                    return
+
+                # Create the map focused on the USA, the Basemap is only built once
+                plt.figure(figsize=(12, 8), dpi=120)
+                m = basemaps.get_basemap(map_name)
+
+                # Draw map features (coastlines, countries, states and counties) from the cached base layer
+                basemaps.draw_base_layer(m, *base_layer)
+
+                # Map coordinates of the grid, projected once and shared by every frame
+                x, y, _ = basemaps.project_grid(m, map_name, lats, lons)
+
+                refc_snow = ptype.layer(category, refc, ptype.SNOW)
+                refc_rain = ptype.layer(category, refc, ptype.RAIN)
+
+                refc_snow_contour = m.contourf(x, y, refc_snow, levels=snow_levels, cmap=cmap_refc_snow, norm=norm_refc_snow)
+                refc_rain_contour = m.contourf(x, y, refc_rain, levels=rain_levels, cmap=cmap_refc_rain, norm=norm_refc_rain)
+
+                mixed_types = [(ptype.FREEZING_RAIN, cmap_refc_freezing_rain, norm_refc_freezing_rain, '#ff69b4'),
+                               (ptype.SLEET, cmap_refc_sleet, norm_refc_sleet, '#9966ff')]
+                mixed_types = [mixed for mixed in mixed_types if np.any(category == mixed[0])]
+                for kind, cmap, norm, _ in mixed_types:
+                    m.contourf(x, y, ptype.layer(category, refc, kind), levels=mixed_levels, cmap=cmap, norm=norm)
+
+                # Move the color bar for rain to the left side
+                cbar_rain = m.colorbar(refc_rain_contour, location='left', pad=0.05, size="5%", shrink=0.8)
+                cbar_rain.set_label('Rain Reflectivity (dBZ)', fontsize=10)
+
+                # Move the color bar for snow to the right side
+                cbar_snow = m.colorbar(refc_snow_contour, location='right', pad=0.05, size="5%", shrink=0.8)
+                cbar_snow.set_label('Snow Reflectivity (dBZ)', fontsize=10)
+
+                from matplotlib.lines import Line2D
+                legend_elements = [
+                    Line2D([0], [0], marker='o', color='w', markerfacecolor='b', markersize=10, label="Rain"),
+                    Line2D([0], [0], marker='o', color='w', markerfacecolor='c', markersize=10, label="Snow")
+                ]
+                legend_elements += [Line2D([0], [0], marker='o', color='w', markerfacecolor=color, markersize=10,
+                                           label=ptype.NAMES[kind]) for kind, _, _, color in mixed_types]
+                plt.legend(handles=legend_elements, loc='lower right', fontsize=10)
+
+                plt.title(f'Snow and Rain - Reflectivity at 2m Above Ground - {forecast_step} Hour: {hour_str}00Z', fontsize=14)
+                plt.savefig(output_filename, dpi=150)
+                plt.close()
+                print(f"Plot saved: {output_filename}")
+    except Exception as e:
+        print(f"Error generating plot: {e}")
+
 # Function to run the main task
 def run_task():
-    # Delete old files in each folder before starting
-    delete_all_files_in_folder(grib_folder_temp)
-    delete_all_files_in_folder(grib_folder_refc)
+    # Delete old images before starting, GRIB files from older runs are pruned once the run is known
     delete_all_files_in_folder(rs_folder)
 
-    # Get today's date and format it for the URL
-    today = datetime.now()
-    date_str = today.strftime("%Y%m%d")
-
-    # Determine the most recent GFS run based on the current hour
-    current_hour = today.hour
-    hour_str = f"{(current_hour // 6) * 6:02d}"  # Get the latest run in 6-hour intervals
-
-    # Forecast steps limited to f000 to f012 and then every 6 hours up to f096
-    forecast_steps = [f"f{str(i).zfill(3)}" for i in range(13)]  # Generates ['f000', ..., 'f012']
-    forecast_steps += [f"f{str(i).zfill(3)}" for i in range(12, 97, 6)]  # Adds ['f018', ..., 'f096']
-
-    # Variables to download
-    variable_temp = "TMP"  # Temperature
-    variable_refc = "REFC"  # Reflectivity
-
-    # Function to check if the file exists on the server
-    def file_exists(url):
-        response = requests.head(url)
-        return response.status_code == 200
-
-    # Try the most recent GFS run and fall back if necessary
-    run_found = False
-    for hour in [hour_str, f"{(int(hour_str) - 6) % 24:02d}"]:  # Try current and past run
-        for step in forecast_steps:
-            # Build the URL with the specified variables for both temperature and reflectivity
-            url_temp = (f"https://nomads.ncep.noaa.gov/cgi-bin/filter_gfs_0p25.pl?dir=%2Fgfs.{date_str}%2F{hour}%2Fatmos"
-                        f"&file=gfs.t{hour}z.pgrb2.0p25.{step}&var_{variable_temp}=on&lev_2_m_above_ground=on")
-            url_refc = (f"https://nomads.ncep.noaa.gov/cgi-bin/filter_gfs_0p25.pl?dir=%2Fgfs.{date_str}%2F{hour}%2Fatmos"
-                        f"&file=gfs.t{hour}z.pgrb2.0p25.{step}&var_{variable_refc}=on&lev_entire_atmosphere=on")
-
-            # Check if the temperature and reflectivity files exist
-            if file_exists(url_temp) and file_exists(url_refc):
-                filename_temp = os.path.join(grib_folder_temp, f"gfs.t{hour}z.pgrb2.0p25.{step}.grib2")
-                filename_refc = os.path.join(grib_folder_refc, f"gfs.t{hour}z.pgrb2.0p25.{step}.grib2")
-
-                # Download the files
-                response_temp = requests.get(url_temp)
-                response_refc = requests.get(url_refc)
-                if response_temp.status_code == 200 and response_refc.status_code == 200:
-                    with open(filename_temp, 'wb') as file:
-                        file.write(response_temp.content)
-                    with open(filename_refc, 'wb') as file:
-                        file.write(response_refc.content)
-                    print(f"Downloaded: {filename_temp} and {filename_refc}")
-                    run_found = True
-                else:
-                    print(f"Failed to download {filename_temp} or {filename_refc}. Status code: {response_temp.status_code}")
-
-        if run_found:
-            break
-
-    if not run_found:
-        print("No valid GFS data was found for the specified runs.")
-
-    # Define reflectivity bounds and colors for snow and rain with custom levels and colors
-    rain_levels = [10, 20, 30, 40, 50, 60, 75]
-    rain_colors = ['#b2ff59', '#66bb6a', '#006400', '#ffff00', '#ff8c00', '#ff0000']  # Light green to dark red
-    cmap_refc_rain = plt.cm.colors.ListedColormap(rain_colors)
-    norm_refc_rain = plt.cm.colors.BoundaryNorm(rain_levels, cmap_refc_rain.N)
-
-    snow_levels = [0, 5, 10, 15, 20, 25, 30, 35, 40]  
-    snow_colors = ['#e0f7fa', '#b3e5fc', '#81d4fa', '#4fc3f7', '#29b6f6', '#039be5',  
-               '#0288d1', '#0277bd', '#01579b']  # Light to dark blue  
-    cmap_refc_snow = plt.cm.colors.ListedColormap(snow_colors)  
-    norm_refc_snow = plt.cm.colors.BoundaryNorm(snow_levels, cmap_refc_snow.N)
-
-    # Function to generate a single reflectivity plot for both snow and rain
-    def create_combined_reflectivity_plot(file_path_temp, file_path_refc, output_filename, forecast_step):
-        try:
-            dataset_temp = xr.open_dataset(file_path_temp, engine="cfgrib")
-            dataset_refc = xr.open_dataset(file_path_refc, engine="cfgrib")
-
-            if 't2m' in dataset_temp.variables:
-                temperature_k = dataset_temp['t2m']
-                temperature_f = (temperature_k - 273.15) * 9 / 5 + 32
-                lats = dataset_temp['latitude'].values
-                lons = dataset_temp['longitude'].values
-
-                if 'refc' in dataset_refc.variables:
-                    refc = dataset_refc['refc']
-                    lons = np.where(lons > 180, lons - 360, lons)
-                    lon_grid, lat_grid = np.meshgrid(lons, lats)
-
-                    # Create the map focused on the USA
-                    plt.figure(figsize=(12, 8), dpi=120)
-                    m = Basemap(projection='lcc', resolution='i',  # 'i' resolution for more detail
-                                lat_0=37.5, lon_0=-98.35,
-                                width=6e6, height=3e6)
-
-                    # Draw map features
-                    m.drawcoastlines(linewidth=0.8)
-                    m.drawcountries(linewidth=0.8)
-                    m.drawstates(linewidth=0.5)
-                    m.drawcounties(linewidth=0.4, color='gray')  # Add counties to the map
-
-                    snow_mask = temperature_f < 32
-                    refc_snow = np.ma.masked_where(~snow_mask, refc)
-
-                    rain_mask = temperature_f >= 32
-                    refc_rain = np.ma.masked_where(~rain_mask, refc)
-
-                    refc_snow_contour = m.contourf(lon_grid, lat_grid, refc_snow, levels=snow_levels, cmap=cmap_refc_snow, norm=norm_refc_snow, latlon=True)
-                    refc_rain_contour = m.contourf(lon_grid, lat_grid, refc_rain, levels=rain_levels, cmap=cmap_refc_rain, norm=norm_refc_rain, latlon=True)
-
-                    # Move the color bar for rain to the left side
-                    cbar_rain = m.colorbar(refc_rain_contour, location='left', pad=0.05, size="5%", shrink=0.8)
-                    cbar_rain.set_label('Rain Reflectivity (dBZ)', fontsize=10)
-
-                    # Move the color bar for snow to the right side
-                    cbar_snow = m.colorbar(refc_snow_contour, location='right', pad=0.05, size="5%", shrink=0.8)
-                    cbar_snow.set_label('Snow Reflectivity (dBZ)', fontsize=10)
-
-                    from matplotlib.lines import Line2D
-                    legend_elements = [
-                        Line2D([0], [0], marker='o', color='w', markerfacecolor='b', markersize=10, label="Rain"),
-                        Line2D([0], [0], marker='o', color='w', markerfacecolor='c', markersize=10, label="Snow")
-                    ]
-                    plt.legend(handles=legend_elements, loc='lower right', fontsize=10)
-
-                    plt.title(f'Snow and Rain - Reflectivity at 2m Above Ground - {forecast_step} Hour: {hour_str}00Z', fontsize=14)
-                    plt.savefig(output_filename, dpi=150)
-                    plt.close()
-                    print(f"Plot saved: {output_filename}")
-        except Exception as e:
-            print(f"Error generating plot: {e}")
-
+    # Fetch the latest run once for every product (steps already on disk are skipped)
+    run = ingest.ingest()
+    if run is None:
+        # The folder was emptied, let the web app know
+        catalog.publish("USA", rs_folder)
+        return
+    date_str, hour_str = run
+    forecast_steps = ingest.FORECAST_STEPS
 
-    # Generate and save plots
-    image_paths = []
-    for step in forecast_steps:
-        temp_file_path = os.path.join(grib_folder_temp, f"gfs.t{hour_str}z.pgrb2.0p25.{step}.grib2")
-        refc_file_path = os.path.join(grib_folder_refc, f"gfs.t{hour_str}z.pgrb2.0p25.{step}.grib2")
-        output_filename = os.path.join(rs_folder, f"Rain_Snow_reflectivity_{date_str}_{hour_str}_{step}.png")
+    # Draw the geography once here so the render workers share it
+    basemaps.base_layer(*base_layer)
 
-        create_combined_reflectivity_plot(temp_file_path, refc_file_path, output_filename, step)
-        image_paths.append(output_filename)
+    # Generate and save plots in parallel, image_paths keeps the order of the forecast steps
+    image_paths = [os.path.join(rs_folder, f"Rain_Snow_reflectivity_{date_str}_{hour_str}_{step}.png") for step in forecast_steps]
+    tasks = [(date_str, hour_str, step, output_filename) for step, output_filename in zip(forecast_steps, image_paths)]
 
-    # Generate a GIF of all the images
+    # Add each plot to the GIF as soon as it and the ones before it are done, one frame in memory at a time
+    # The animation palette holds the freezing rain and sleet colors the first frames lack
     gif_filename = os.path.join(rs_folder, "GIF_reflectivity_animation.gif")
-    images = [Image.open(img) for img in image_paths]
-    images[0].save(gif_filename, save_all=True, append_images=images[1:], duration=1000, loop=0)
+    with animation.Animations(gif_filename, animation_formats, duration=1000, **raster.animation_palette(fast_palette)) as animations:
+        for output_filename, _ in zip(image_paths, render.iter_frames(create_combined_reflectivity_plot, tasks)):
+            if os.path.exists(output_filename):
+                animations.add(output_filename)
+    # Tiles of steps that were not rendered this run are from an older one
+    tiles.prune(product, [step for step, output_filename in zip(forecast_steps, image_paths) if os.path.exists(output_filename)])
 
     print(f"GIF saved: {gif_filename}")
 
+    # Publish the new files to the web app's catalog
+    catalog.publish("USA", rs_folder, date_str + hour_str)
+
 # Run the task
-run_task()
+if __name__ == '__main__':
+    run_task()
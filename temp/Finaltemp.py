@@ -1,17 +1,14 @@
 import os
 import shutil
-import requests
-import xarray as xr
+import sys
 import numpy as np
 import matplotlib.pyplot as plt
-from mpl_toolkits.basemap import Basemap
-from datetime import datetime
-from PIL import Image
 
-# Folder paths for GRIB data and image outputs
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from gfs import animation, basemaps, catalog, download, ingest, raster, render, tiles
+
+# Folder paths for image outputs, GRIB data is shared through gfs.ingest
 base_folder = "./public"
-grib_folder = os.path.join(base_folder, "grib")
-grib_folder_surft = os.path.join(grib_folder, "surft")  # Add the 'surft' folder
 images_folder = os.path.join(base_folder, "images")
 temp_folder = os.path.join(base_folder, "temp")
 
@@ -28,102 +25,58 @@ def clear_folder(folder_path):
             except Exception as e:
                 print(f"Failed to delete {file_path}: {e}")
 
-# Clear the 'surft' and 'temp' folders before execution
-clear_folder(grib_folder_surft)
-clear_folder(temp_folder)
-
-# Ensure the folders exist
-os.makedirs(grib_folder, exist_ok=True)
-os.makedirs(grib_folder_surft, exist_ok=True)  # Ensure 'surft' folder exists
-os.makedirs(temp_folder, exist_ok=True)
-
-# Get today's date and format it for the URL
-today = datetime.now()
-date_str = today.strftime("%Y%m%d")
-
-# Determine the most recent GFS run based on the current hour
-current_hour = today.hour
-hour_str = f"{(current_hour // 6) * 6:02d}"  # Get the latest run in 6-hour intervals
-
-# Forecast steps limited to f000 to f012 and then every 6 hours up to f096
-forecast_steps = [f"f{str(i).zfill(3)}" for i in range(13)]  # Generates ['f000', ..., 'f012']
-forecast_steps += [f"f{str(i).zfill(3)}" for i in range(12, 97, 6)]  # Adds ['f018', ..., 'f096']
-
-# Variable to download
-variable = "TMP"  # Temperature
-
-# Function to check if the file exists on the server
-def file_exists(url):
-    response = requests.head(url)
-    return response.status_code == 200
-
-# Try the most recent GFS run and fall back if necessary
-run_found = False
-for hour in [hour_str, f"{(int(hour_str) - 6) % 24:02d}"]:  # Try current and past run
-    for step in forecast_steps:
-        # Build the URL with the specified variable
-        url = (f"https://nomads.ncep.noaa.gov/cgi-bin/filter_gfs_0p25.pl?dir=%2Fgfs.{date_str}%2F{hour}%2Fatmos"
-               f"&file=gfs.t{hour}z.pgrb2.0p25.{step}&var_{variable}=on&lev_2_m_above_ground=on")
-
-        # Check if the file exists
-        if file_exists(url):
-            filename = os.path.join(grib_folder_surft, f"gfs.t{hour}z.pgrb2.0p25.{step}.grib2")  # Save to 'surft' folder
-
-            # Request the file from the URL
-            response = requests.get(url)
-            if response.status_code == 200:
-                with open(filename, 'wb') as file:
-                    file.write(response.content)
-                print(f"Downloaded: {filename}")
-                run_found = True
-            else:
-                print(f"Failed to download {filename}. Status code: {response.status_code}")
-
-    # If files are found for this run, exit the loop
-    if run_found:
-        break
-
-if not run_found:
-    print("No valid GFS data was found for the specified runs.")
+# Cached geography every frame is drawn on: map, lines, width in inches and dpi of the saved frames
+base_layer = ("conus", basemaps.STATE_LINES, 12, 100)
+
+# Formats the animation is written in (gfs.animation.FORMATS), the GIF stays for older browsers
+animation_formats = ("gif", "webp")
+
+# Define temperature bounds and corresponding colors
+bounds = [-90, -70, -50, -40, -30, -20, 0, 10, 32, 40, 50, 60, 70, 80, 90, 100, 120]
+colors = [
+    '#FFB6C1', '#FF69B4', '#D84C9A', '#9B36A2', '#6A0DAD', '#4B0082', '#8A2BE2', '#4169E1',
+    '#90EE90', '#32CD32', '#228B22', '#FFFF00', '#FFA500', '#FF4500', '#B22222', '#000000'
+]
+cmap = plt.cm.colors.ListedColormap(colors)
+norm = plt.cm.colors.BoundaryNorm(bounds, cmap.N)
+
+# Palette of the fast render mode, the map tiles and the animations
+palette = raster.make_palette((bounds, cmap, norm))
 
 # Function to generate the plot
-def create_temperature_plot(file_path, output_filename):
+# It runs in a worker process of gfs.render, so it only uses its arguments and module level names
+def create_temperature_plot(run_id, step, output_filename):
     try:
-        # Open the GRIB2 file with xarray
-        dataset = xr.open_dataset(file_path, engine="cfgrib")
+        # Load the 2-meter temperature decoded by the ingest stage, already cut to this map
+        temperature = ingest.load_field(run_id, step, download.TMP_2M, "temperature")
 
-        # Check if the 2-meter temperature ('t2m') is available
-        if 't2m' in dataset.variables:
-            temperature_k = dataset['t2m']  # Temperature in Kelvin at 2 meters
+        # Check if the 2-meter temperature was decoded for this step
+        if temperature is not None:
+            temperature_k = temperature.values  # Temperature in Kelvin at 2 meters
             temperature_f = (temperature_k - 273.15) * 9 / 5 + 32  # Convert to Fahrenheit
-            lats = dataset['latitude'].values
-            lons = dataset['longitude'].values
-
-            # Convert longitude to match Basemap's format (-180 to 180)
-            lons = np.where(lons > 180, lons - 360, lons)
+            lats = temperature.lats
+            lons = temperature.lons  # Already -180 to 180 like Basemap
 
-            # Create a meshgrid for plotting
-            lon_grid, lat_grid = np.meshgrid(lons, lats)
+            # Palette indexes of the frame, written as map tiles and drawn directly in the fast mode
+            index = raster.color_index(palette, 0, temperature_f, np.zeros(temperature_f.shape, dtype=np.uint8))
+            tiles.write_tiles("temperature", step, run_id, palette, index, lats, lons, ingest.product_region("temperature"))
 
-            # Define temperature bounds and corresponding colors
-            bounds = [-90, -70, -50, -40, -30, -20, 0, 10, 32, 40, 50, 60, 70, 80, 90, 100, 120]
-            colors = [
-                '#FFB6C1', '#FF69B4', '#D84C9A', '#9B36A2', '#6A0DAD', '#4B0082', '#8A2BE2', '#4169E1',
-                '#90EE90', '#32CD32', '#228B22', '#FFFF00', '#FFA500', '#FF4500', '#B22222', '#000000'
-            ]
-            cmap = plt.cm.colors.ListedColormap(colors)
-            norm = plt.cm.colors.BoundaryNorm(bounds, cmap.N)
+            if render.RENDER_MODE == "fast":
+                # Straight to pixels through the palette, without contour polygons
+                raster.save_frame(output_filename, palette, index, lats, lons, base_layer)
+                print(f"Plot saved: {output_filename}")
+                return
 
-            # Set up the Basemap
+            # Set up the Basemap (built once and cached) and its coastlines, countries and states
             fig, ax = plt.subplots(figsize=(14, 10))
-            m = Basemap(projection='cyl', llcrnrlat=20, urcrnrlat=50,
-                        llcrnrlon=-130, urcrnrlon=-60, resolution='i', ax=ax)
-            m.drawcoastlines()
-            m.drawcountries()
-            m.drawstates()
+            m = basemaps.get_basemap("conus", ax=ax)
+            basemaps.draw_base_layer(m, *base_layer)
+
+            # Map coordinates of the grid, projected once and shared by every frame
+            x, y, _ = basemaps.project_grid(m, "conus", lats, lons)
 
             # Plot temperature data
-            temp_contour = m.contourf(lon_grid, lat_grid, temperature_f, levels=bounds, cmap=cmap, norm=norm, latlon=True)
+            temp_contour = m.contourf(x, y, temperature_f, levels=bounds, cmap=cmap, norm=norm)
             cbar = m.colorbar(temp_contour, location='right', pad=0.05)
             cbar.set_label('Temperature (°F)', fontsize=12)
             cbar.ax.tick_params(labelsize=10)
@@ -136,27 +89,44 @@ def create_temperature_plot(file_path, output_filename):
             plt.close()
             print(f"Plot saved: {output_filename}")
         else:
-            print("The dataset does not contain the 't2m' variable (2-meter temperature).")
+            print(f"No 2-meter temperature was decoded for {step}.")
 
     except Exception as e:
-        print(f"Error opening the GRIB2 file: {e}")
-
-# Generate the plots for each forecast step
-image_files = []
-for hour in [hour_str, f"{(int(hour_str) - 6) % 24:02d}"]:  # Try current and past run
-    for step in forecast_steps:
-        grib_file_path = os.path.join(grib_folder_surft, f"gfs.t{hour}z.pgrb2.0p25.{step}.grib2")  # Use 'surft' folder
-        if os.path.exists(grib_file_path):
-            output_filename = os.path.join(temp_folder, f"temperature_{hour}_{step}.png")
-            create_temperature_plot(grib_file_path, output_filename)
-            image_files.append(output_filename)
-
-# Create an animated GIF
-plot_files = [os.path.join(temp_folder, f"temperature_{hour}_{step}.png") for hour in [hour_str, f"{(int(hour_str) - 6) % 24:02d}"] for step in forecast_steps]
-images = [Image.open(file) for file in plot_files if os.path.exists(file)]
-animation_path = os.path.join(temp_folder, "gfs_animation.gif")
-if images:
-    images[0].save(animation_path, save_all=True, append_images=images[1:], duration=500, loop=0)
-    print(f"GIF created: {animation_path}")
-else:
-    print("No images found to create a GIF.")
+        print(f"Error generating plot: {e}")
+
+if __name__ == '__main__':
+    # Clear the 'temp' image folder before execution
+    clear_folder(temp_folder)
+
+    # Ensure the folders exist
+    os.makedirs(temp_folder, exist_ok=True)
+
+    # Fetch the latest run once for every product (steps already on disk are skipped)
+    forecast_steps = ingest.FORECAST_STEPS
+    run = ingest.ingest()
+
+    # Draw the geography once here so the render workers share it
+    basemaps.base_layer(*base_layer)
+
+    # Generate the plots for each forecast step of the run in parallel, image_files keeps their order,
+    # and add each one to the animations as soon as it and the ones before it are done
+    animation_path = os.path.join(temp_folder, "gfs_animation.gif")
+    animations = animation.Animations(animation_path, animation_formats, duration=500, **raster.animation_palette(palette))
+    if run is not None:
+        date_str, hour_str = run
+        image_files = [os.path.join(temp_folder, f"temperature_{hour_str}_{step}.png") for step in forecast_steps]
+        tasks = [(date_str + hour_str, step, output_filename) for step, output_filename in zip(forecast_steps, image_files)]
+        for file, _ in zip(image_files, render.iter_frames(create_temperature_plot, tasks)):
+            if os.path.exists(file):
+                animations.add(file)
+        # Tiles of steps that were not rendered this run are from an older one
+        tiles.prune("temperature", [step for step, file in zip(forecast_steps, image_files) if os.path.exists(file)])
+
+    animation_paths = animations.close()
+    if animation_paths:
+        print(f"Animations created: {', '.join(animation_paths)}")
+    else:
+        print("No images found to create a GIF.")
+
+    # Publish the new files to the web app's catalog
+    catalog.publish("temp", temp_folder, None if run is None else "".join(run))
@@ -0,0 +1,58 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from matplotlib.colors import BoundaryNorm, ListedColormap
+
+from app import app
+from gfs import raster, regions, tiles
+
+# Tests of the routes of the web app, run with
+#   python -m unittest discover -s . -p "*test*.py"
+
+
+class TileRouteTest(unittest.TestCase):
+    def setUp(self):
+        # The routes read paths relative to the repository, so run them in an empty folder
+        self.cwd = os.getcwd()
+        self.folder = tempfile.mkdtemp()
+        os.chdir(self.folder)
+        self.client = app.test_client()
+
+        # One store with data over a small box, at one zoom level
+        self.region = regions.Region(30, 40, -100, -90)
+        lats = np.arange(30, 40.25, 0.25)
+        lons = np.arange(-100, -89.75, 0.25)
+        cmap = ListedColormap(['#ff0000'])
+        palette = raster.make_palette(([0, 10], cmap, BoundaryNorm([0, 10], cmap.N)))
+        index = np.ones((len(lats), len(lons)), dtype=np.uint8)
+        tiles.write_tiles("temperature", "f006", "2025030212", palette, index, lats, lons, self.region, zooms=(3,))
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.folder)
+
+    def test_tile(self):
+        columns, rows = tiles.tile_range(self.region, 3)
+        response = self.client.get(f"/tiles/temperature/f006/3/{columns[0]}/{rows[0]}.png")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, tiles.read_tile("temperature", "f006", 3, columns[0], rows[0]))
+        self.assertNotEqual(response.data, tiles.EMPTY_TILE)
+
+    def test_missing_tile_in_store(self):
+        # A part of the map without data in a store that exists is a transparent tile
+        response = self.client.get("/tiles/temperature/f006/3/7/0.png")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, tiles.EMPTY_TILE)
+
+    def test_missing_store(self):
+        # Unknown products and steps without a store (never written or pruned) are not found
+        for url in ("/tiles/temperatrue/f006/3/1/3.png", "/tiles/temperature/f012/3/1/3.png",
+                    "/tiles/temperature/f006.x/3/1/3.png"):
+            self.assertEqual(self.client.get(url).status_code, 404, url)
+
+
+if __name__ == '__main__':
+    unittest.main()